@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Benchmark the JPEG quality search in compress_image.
+
+Compares the previous linear search (quality 80 down in steps of 5, with
+0.8x shrinks below quality 20) against the current bounded search. Reports
+the number of JPEG encodes and wall time per image.
+
+Usage (from the backend directory):
+    python benchmark_compress_image.py [IMAGE_DIR ...]
+
+Without arguments the corpus is every image under uploads/ plus a few
+generated hard-to-compress images (noise and fine detail).
+"""
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+# server.py reads these at import time; the benchmark never touches MongoDB
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from PIL import Image
+
+import server
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def legacy_encode(img: Image.Image, max_size: int = server.MAX_IMAGE_SIZE_BYTES) -> bytes:
+    """The quality search compress_image used before the bounded search."""
+    quality = 80
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality, optimize=True)
+
+    while output.tell() > max_size and quality > 10:
+        quality -= 5
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+
+        if quality <= 20 and output.tell() > max_size:
+            ratio = 0.8
+            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
+            img = img.resize(new_size, Image.LANCZOS)
+            quality = 50
+
+    return output.getvalue()
+
+
+def synthetic_corpus() -> list:
+    noise = Image.effect_noise((1600, 1200), 90).convert('RGB')
+    mandel = Image.effect_mandelbrot((1600, 1200), (-2.2, -1.2, 1.0, 1.2), 200).convert('RGB')
+    detail = Image.frombytes('RGB', (1600, 1066), os.urandom(1600 * 1066 * 3))
+    return [("synthetic-noise", noise), ("synthetic-mandelbrot", mandel), ("synthetic-random", detail)]
+
+
+def file_corpus(dirs: list) -> list:
+    corpus = []
+    for directory in dirs:
+        for path in sorted(Path(directory).rglob("*")):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                corpus.append((str(path.relative_to(directory)), server.prepare_image(path)))
+    return corpus
+
+
+def measure(encode, img: Image.Image) -> tuple:
+    """Run one encode strategy, returning (encodes, milliseconds, output bytes)."""
+    encodes = 0
+    original_save = Image.Image.save
+
+    def counting_save(self, *args, **kwargs):
+        nonlocal encodes
+        encodes += 1
+        return original_save(self, *args, **kwargs)
+
+    Image.Image.save = counting_save
+    try:
+        started = time.perf_counter()
+        data = encode(img.copy())
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    finally:
+        Image.Image.save = original_save
+    return encodes, elapsed_ms, len(data)
+
+
+def main(argv: list) -> int:
+    dirs = argv or [str(server.UPLOAD_DIR)]
+    corpus = file_corpus(dirs) + synthetic_corpus()
+
+    header = f"{'image':44} {'legacy enc':>10} {'ms':>8} {'KB':>6} | {'new enc':>7} {'ms':>8} {'KB':>6}"
+    print(header)
+    print("-" * len(header))
+    totals = {"legacy": [0, 0.0, 0], "new": [0, 0.0, 0]}
+    for name, img in corpus:
+        legacy = measure(legacy_encode, img)
+        new = measure(server.encode_jpeg_under, img)
+        for key, result in (("legacy", legacy), ("new", new)):
+            totals[key][0] = max(totals[key][0], result[0])
+            totals[key][1] += result[1]
+            totals[key][2] += result[0]
+        print(f"{name[-44:]:44} {legacy[0]:>10} {legacy[1]:>8.0f} {legacy[2] // 1024:>6} | "
+              f"{new[0]:>7} {new[1]:>8.0f} {new[2] // 1024:>6}")
+
+    print("-" * len(header))
+    for key in ("legacy", "new"):
+        worst, total_ms, total_encodes = totals[key]
+        print(f"{key:6}: {len(corpus)} images, {total_encodes} encodes "
+              f"(worst {worst}), {total_ms:.0f} ms total")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,20 +1,43 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Header
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Header, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, UpdateMany, ReplaceOne, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+import asyncio
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, computed_field
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
 import shutil
-from PIL import Image
+import stat
+import glob
+from PIL import Image, ImageOps, UnidentifiedImageError, features
 import io
+import typer
+import base64
+import json
+import re
+from email.utils import formatdate, parsedate_to_datetime
+import csv
+import gzip
+from functools import lru_cache
+from collections import Counter, OrderedDict, deque
+import time
+import hashlib
+import hmac
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import tempfile
+from typing import AsyncIterator, Callable, NamedTuple, Union
+from abc import ABC, abstractmethod
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -29,52 +52,911 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'nextriders-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
-# Upload directory
+# bcrypt runs on a small thread pool (it releases the GIL) so logins never
+# stall the event loop. At most AUTH_CONCURRENCY login/register requests per
+# worker hash at once and AUTH_QUEUE_LIMIT more may wait up to
+# AUTH_QUEUE_TIMEOUT seconds; anything beyond that gets 429 + Retry-After.
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+AUTH_CONCURRENCY = int(os.environ.get('AUTH_CONCURRENCY', PASSWORD_HASH_WORKERS * 2))
+AUTH_QUEUE_LIMIT = int(os.environ.get('AUTH_QUEUE_LIMIT', 64))
+AUTH_QUEUE_TIMEOUT = float(os.environ.get('AUTH_QUEUE_TIMEOUT', 2))
+AUTH_RETRY_AFTER_SECONDS = 2
+# Recent bcrypt durations kept for the latency percentiles in /api/metrics
+HASH_LATENCY_SAMPLES = 1000
+# /api/metrics wants `Authorization: Bearer <METRICS_TOKEN>`; without a token
+# configured it only answers direct (unproxied) requests from private networks
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Authenticated users and verified tokens are cached per worker so polling
+# routes skip the users lookup and the JWT signature check. Profile writes
+# invalidate locally and, via the `cache_invalidations` collection, on other
+# workers within USER_CACHE_SYNC_SECONDS; the TTL bounds anything missed.
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', 60))
+USER_CACHE_SYNC_SECONDS = float(os.environ.get('USER_CACHE_SYNC_SECONDS', 2))
+TOKEN_CACHE_TTL_SECONDS = 300
+CACHE_INVALIDATION_RETENTION_SECONDS = 3600
+
+# Message events are pushed to browsers over Server-Sent Events (GET
+# /api/events). EVENT_BROKER "local" delivers within this worker only; "mongo"
+# fans events out to every worker through a change stream on the `events`
+# collection, which needs a replica set (MongoDB Atlas is one).
+EVENT_BROKER = os.environ.get('EVENT_BROKER', 'local')
+EVENT_RETENTION_SECONDS = 300
+# EventSource can't send an Authorization header, so a stream is opened with
+# a single-use ticket (POST /api/events/ticket) that expires after this long
+EVENT_TICKET_TTL_SECONDS = 30
+# Events buffered per open stream before a slow client is told to resync
+EVENT_QUEUE_SIZE = 256
+SSE_KEEPALIVE_SECONDS = 15
+
+# Upload directory (local image storage)
 UPLOAD_DIR = ROOT_DIR / "uploads"
 UPLOAD_DIR.mkdir(exist_ok=True)
+# Listing images are stored once per distinct content under blobs/, named by
+# the SHA-256 of the full rendition, and reference-counted in `image_blobs`.
+# Deleting a blob marks its record (`deleting_at`) before removing files; new
+# references wait for that to finish, or take over a deletion that went stale.
+BLOB_PREFIX = "blobs"
+BLOB_DELETE_STALE_SECONDS = 300
+
+# Image storage: "local" keeps files in UPLOAD_DIR; "s3" uses an S3-compatible
+# bucket (AWS S3, MinIO, R2, ...) so several instances can share images and
+# they survive redeploys. S3 credentials come from the standard AWS_* variables.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.environ.get('S3_BUCKET')
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+S3_REGION = os.environ.get('S3_REGION')
+S3_KEY_PREFIX = os.environ.get('S3_KEY_PREFIX', '')
+S3_MAX_CONNECTIONS = int(os.environ.get('S3_MAX_CONNECTIONS', 32))
+# Objects that can't be served from a local file are streamed in chunks
+STORAGE_STREAM_CHUNK_BYTES = 256 * 1024
+
+# Offline US ZIP centroid table (zip,lat,lng), derived from the MIT-licensed
+# `zipcodes` package data
+ZIP_CENTROIDS_FILE = ROOT_DIR / "data" / "zip_centroids.csv.gz"
+METERS_PER_MILE = 1609.344
+EARTH_RADIUS_MILES = 3963.2
+
+# Search facets are cached briefly per normalized filter set
+FACETS_CACHE_TTL_SECONDS = 30
+PRICE_BANDS = [0, 5000, 10000, 15000, 20000, 30000, 50000, 75000, 100000]
+YEAR_RANGES = [1900, 1990, 2000, 2005, 2010, 2015, 2020, 2100]
+HISTOGRAM_BUCKETS = 10
+
+# Make/model dropdown lists: invalidated locally on writes, the TTL covers
+# writes made by other workers. Browsers may reuse them for MAX_AGE seconds.
+MAKES_CACHE_TTL_SECONDS = 300
+MAKES_MAX_AGE_SECONDS = 300
 
 # Maximum image size after compression (0.5MB = 512KB)
 MAX_IMAGE_SIZE_BYTES = 500 * 1024
-
-def compress_image(image_bytes: bytes, max_size: int = MAX_IMAGE_SIZE_BYTES) -> bytes:
-    """Compress image to JPEG format with size limit."""
-    img = Image.open(io.BytesIO(image_bytes))
+# Longest side of stored images
+MAX_IMAGE_DIMENSION = 1600
+# Renditions generated for every listing image: name -> (longest side, max bytes).
+# `full` keeps the original `{i}.jpg` file name so existing URLs stay valid.
+IMAGE_RENDITIONS = {
+    "full": (MAX_IMAGE_DIMENSION, MAX_IMAGE_SIZE_BYTES),
+    "card": (800, 150 * 1024),
+    "thumb": (320, 40 * 1024),
+}
+
+# Image responses: content-addressed or versioned (`?v=`) URLs never change and
+# are cached for a year; anything else is revalidated with ETag/Last-Modified
+IMAGE_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_REVALIDATE_CACHE_CONTROL = "public, no-cache"
+IMAGE_MEDIA_TYPES = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png",
+    ".gif": "image/gif", ".webp": "image/webp", ".avif": "image/avif",
+}
+IMAGE_PATH_SEGMENT = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+# Avatars are centre-cropped squares: name -> (side, max bytes). `full` is
+# for profile pages, `card` for listing cards, `thumb` for message threads.
+AVATAR_RENDITIONS = {
+    "full": (256, 24 * 1024),
+    "card": (96, 6 * 1024),
+    "thumb": (48, 3 * 1024),
+}
+AVATAR_MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+# Avatar files embed a hash of the upload, so their URLs never change content
+AVATAR_VERSIONED_FILENAME = re.compile(r"-[0-9a-f]{16}(_[a-z]+)?\.jpg$")
+
+# Modern formats served to browsers that accept them, in order of preference:
+# (media type, file extension, Pillow format, save options). The first request
+# for a variant queues a transcode of the stored JPEG and gets the JPEG; the
+# result is cached next to it. A variant that isn't smaller than the JPEG is
+# cached as an empty file, meaning "serve the JPEG".
+IMAGE_VARIANTS = [
+    variant for variant, supported in [
+        (("image/avif", "avif", "AVIF", {"quality": 60}), features.check("avif")),
+        (("image/webp", "webp", "WEBP", {"quality": 80, "method": 4}), features.check("webp")),
+    ] if supported
+]
+
+# JPEG quality search bounds: at most JPEG_MAX_PROBES + 2 encodes per scale,
+# and at most JPEG_MAX_RESCALES downscales for images that don't fit
+JPEG_MAX_QUALITY = 80
+JPEG_MIN_QUALITY = 40
+JPEG_MAX_PROBES = 4
+JPEG_MAX_RESCALES = 3
+
+# Starlette spools a multipart body to disk before the route runs, so
+# whole request bodies are capped up front by Content-Length (and while they
+# stream in) at MAX_REQUEST_BYTES, or the avatar limit on the avatar route.
+# Each file is then checked against MAX_UPLOAD_BYTES as it is copied off the
+# spool; images above MAX_UPLOAD_PIXELS are never decoded.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get('MAX_REQUEST_BYTES', 100 * 1024 * 1024))
+# Room for the other form fields and multipart framing around a file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_UPLOAD_PIXELS = int(os.environ.get('MAX_UPLOAD_PIXELS', 50_000_000))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+UPLOAD_TMP_DIR = Path(os.environ.get('UPLOAD_TMP_DIR', tempfile.gettempdir()))
+Image.MAX_IMAGE_PIXELS = MAX_UPLOAD_PIXELS
+
+# Image compression runs on a process pool so CPU-bound PIL work never blocks
+# the event loop. At most IMAGE_QUEUE_LIMIT images per backend worker may be
+# queued or running. Avatar uploads and WebP/AVIF transcodes beyond that wait
+# IMAGE_QUEUE_TIMEOUT seconds for a slot; then avatars get a 503 and the
+# transcode is dropped (tried again on a later request). Transcodes run in the
+# background, at most IMAGE_VARIANT_BACKLOG per backend worker at a time.
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 2))
+IMAGE_QUEUE_LIMIT = int(os.environ.get('IMAGE_QUEUE_LIMIT', IMAGE_WORKERS * 4))
+IMAGE_QUEUE_TIMEOUT = float(os.environ.get('IMAGE_QUEUE_TIMEOUT', 30))
+IMAGE_VARIANT_BACKLOG = int(os.environ.get('IMAGE_VARIANT_BACKLOG', 64))
+
+# Uploads only store the original under originals/ and return; listings show
+# it until a background job (in `image_jobs`) has rendered the blob. Jobs are
+# leased for IMAGE_JOB_LEASE_SECONDS, so work interrupted by a restart or a
+# crashed instance is picked up again. Failed jobs are retried with exponential
+# backoff (by extending the lease) up to IMAGE_JOB_MAX_ATTEMPTS.
+ORIGINALS_PREFIX = "originals"
+ORIGINAL_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+IMAGE_JOB_WORKERS = int(os.environ.get('IMAGE_JOB_WORKERS', 2))
+IMAGE_JOB_LEASE_SECONDS = 300
+IMAGE_JOB_MAX_ATTEMPTS = 3
+IMAGE_JOB_RETRY_SECONDS = 10
+IMAGE_JOB_POLL_SECONDS = 5
+
+class ImageRejected(ValueError):
+    """Raised for uploads that are not images or exceed the pixel limit."""
+
+def open_image(source: Union[bytes, str, Path], target_dimension: int, cover: bool = False) -> Image.Image:
+    """Open an image, refusing oversized ones before any pixel data is decoded.
     
-    # Convert to RGB if necessary (for PNG with transparency, etc.)
+    JPEGs are decoded at a reduced scale (PIL draft mode) that is still at
+    least `target_dimension` on the longest side (the shortest side with
+    `cover`, for centre crops), which bounds decode memory.
+    """
+    try:
+        img = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    except UnidentifiedImageError:
+        raise ImageRejected("unsupported or corrupt image file")
+    except Image.DecompressionBombError:
+        raise ImageRejected(f"Image exceeds {MAX_UPLOAD_PIXELS} pixels")
+    if img.size[0] * img.size[1] > MAX_UPLOAD_PIXELS:
+        raise ImageRejected(f"Image exceeds {MAX_UPLOAD_PIXELS} pixels")
+    if img.format == 'JPEG':
+        # draft() keeps both sides at least as large as the box it is given
+        width, height = img.size
+        scale = target_dimension / (min(width, height) if cover else max(width, height))
+        img.draft('RGB', (max(1, int(width * scale)), max(1, int(height * scale))))
+    return img
+
+def flatten_to_rgb(img: Image.Image) -> Image.Image:
+    """Convert to RGB, compositing transparency (PNG etc.) onto white."""
     if img.mode in ('RGBA', 'LA', 'P'):
         background = Image.new('RGB', img.size, (255, 255, 255))
         if img.mode == 'P':
             img = img.convert('RGBA')
         background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-        img = background
-    elif img.mode != 'RGB':
-        img = img.convert('RGB')
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def prepare_image(source: Union[bytes, str, Path], max_dimension: int = MAX_IMAGE_DIMENSION) -> Image.Image:
+    """Decode an upload to RGB, no larger than max_dimension on its longest side."""
+    img = flatten_to_rgb(open_image(source, max_dimension))
     
     # Resize if image is very large (max 1600px on longest side for better compression)
-    max_dimension = 1600
     if max(img.size) > max_dimension:
         ratio = max_dimension / max(img.size)
         new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
         img = img.resize(new_size, Image.LANCZOS)
     
-    # Start with quality 80 and reduce until under max_size
-    quality = 80
+    return img
+
+def compress_image(source: Union[bytes, str, Path], max_size: int = MAX_IMAGE_SIZE_BYTES) -> bytes:
+    """Compress image to JPEG format with size limit."""
+    return encode_jpeg_under(prepare_image(source), max_size)
+
+def render_image(source: Union[bytes, str, Path]) -> dict:
+    """Produce every rendition in IMAGE_RENDITIONS from a single decode.
+    
+    Smaller renditions are downscaled from the full-size image rather than
+    from the original, so the original is only decoded once.
+    """
+    full = prepare_image(source)
+    renditions = {}
+    for name, (max_dimension, max_size) in IMAGE_RENDITIONS.items():
+        img = full
+        if max(full.size) > max_dimension:
+            ratio = max_dimension / max(full.size)
+            img = full.resize((max(1, int(full.size[0] * ratio)), max(1, int(full.size[1] * ratio))), Image.LANCZOS)
+        renditions[name] = encode_jpeg_under(img, max_size)
+    return renditions
+
+def render_avatar(source: Union[bytes, str, Path]) -> dict:
+    """Centre-cropped square JPEGs of an avatar, keyed like AVATAR_RENDITIONS."""
+    largest = max(side for side, _ in AVATAR_RENDITIONS.values())
+    img = flatten_to_rgb(ImageOps.exif_transpose(open_image(source, largest, cover=True)))
+    return {
+        name: encode_jpeg_under(ImageOps.fit(img, (side, side), Image.LANCZOS), max_size)
+        for name, (side, max_size) in AVATAR_RENDITIONS.items()
+    }
+
+def rendition_filename(filename: str, size: str) -> str:
+    """File name of a rendition: `full` is the original name, others get a suffix."""
+    if size == "full":
+        return filename
+    stem, _, ext = filename.rpartition(".")
+    return f"{stem}_{size}.{ext}"
+
+def blob_key(content_hash: str, size: str = "full") -> str:
+    return f"{BLOB_PREFIX}/{rendition_filename(f'{content_hash}.jpg', size)}"
+
+def blob_url(content_hash: str) -> str:
+    return f"/api/images/{blob_key(content_hash)}"
+
+def blob_hash(url: str) -> Optional[str]:
+    """Content hash of a blob image URL, or None for legacy per-listing images."""
+    prefix = f"/api/images/{BLOB_PREFIX}/"
+    if url.startswith(prefix) and url.endswith(".jpg"):
+        return url[len(prefix):-len(".jpg")]
+    return None
+
+async def write_blob(content_hash: str, renditions: dict) -> None:
+    """Store all renditions of one image under its content hash."""
+    await asyncio.gather(*(
+        storage.put(blob_key(content_hash, size), data, "image/jpeg")
+        for size, data in renditions.items()
+    ))
+
+def transcode_image(data: bytes, image_format: str, options: dict) -> bytes:
+    """Re-encode a stored image into another format."""
+    output = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as img:
+        img.save(output, format=image_format, **options)
+    return output.getvalue()
+
+@lru_cache(maxsize=None)
+def pending_image_placeholder(size: str) -> bytes:
+    """Plain 4:3 JPEG standing in for a rendition that is still being made."""
+    side = IMAGE_RENDITIONS[size][0]
+    return _encode_jpeg(Image.new("RGB", (side, side * 3 // 4), (229, 231, 235)), JPEG_MIN_QUALITY)
+
+def pending_image_count(urls: List[str]) -> int:
+    prefix = f"/api/images/{ORIGINALS_PREFIX}/"
+    return sum(1 for url in urls if url.startswith(prefix))
+
+def image_rendition_urls(path: str) -> dict:
+    return {size: path if size == "full" else f"{path}?size={size}" for size in IMAGE_RENDITIONS}
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
     output = io.BytesIO()
     img.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+def _search_jpeg_quality(img: Image.Image, max_size: int) -> tuple:
+    """Highest JPEG quality in [JPEG_MIN_QUALITY, JPEG_MAX_QUALITY] that fits max_size.
     
-    while output.tell() > max_size and quality > 10:
-        quality -= 5
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        
-        # If still too large at quality 20, resize the image
-        if quality <= 20 and output.tell() > max_size:
-            ratio = 0.8
-            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-            img = img.resize(new_size, Image.LANCZOS)
-            quality = 50  # Reset quality after resize
+    Returns (encoded bytes or None if even the minimum quality is too large,
+    size at the lowest quality tried). Costs at most JPEG_MAX_PROBES + 2 encodes.
+    """
+    best = _encode_jpeg(img, JPEG_MAX_QUALITY)
+    if len(best) <= max_size:
+        return best, len(best)
+    lo_q, lo_data = JPEG_MIN_QUALITY, _encode_jpeg(img, JPEG_MIN_QUALITY)
+    if len(lo_data) > max_size:
+        return None, len(lo_data)
+    hi_q, hi_size = JPEG_MAX_QUALITY, len(best)
+    for _ in range(JPEG_MAX_PROBES):
+        if hi_q - lo_q <= 1:
+            break
+        # Interpolate on the encoded sizes seen so far, but always cut at least
+        # a quarter of the interval so the search converges like bisection
+        span = hi_q - lo_q
+        guess = lo_q + (max_size - len(lo_data)) * span / (hi_size - len(lo_data))
+        q = int(min(max(guess, lo_q + max(1, span // 4)), hi_q - max(1, span // 4)))
+        data = _encode_jpeg(img, q)
+        if len(data) <= max_size:
+            lo_q, lo_data = q, data
+        else:
+            hi_q, hi_size = q, len(data)
+    return lo_data, len(lo_data)
+
+def encode_jpeg_under(img: Image.Image, max_size: int = MAX_IMAGE_SIZE_BYTES) -> bytes:
+    """Encode as JPEG at the highest quality under max_size, shrinking if needed."""
+    for _ in range(JPEG_MAX_RESCALES + 1):
+        data, min_size = _search_jpeg_quality(img, max_size)
+        if data is not None:
+            return data
+        # Encoded size scales roughly with pixel count
+        ratio = min(0.9, max(0.5, 0.95 * (max_size / min_size) ** 0.5))
+        img = img.resize((int(img.size[0] * ratio), int(img.size[1] * ratio)), Image.LANCZOS)
+    return _encode_jpeg(img, JPEG_MIN_QUALITY)
+
+class StoredObject(NamedTuple):
+    size: int
+    modified: float
+    etag: str
+
+class ImageStorage(ABC):
+    """Where uploaded images live. Keys are `/`-separated, e.g. `blobs/<hash>.jpg`."""
     
-    return output.getvalue()
+    @abstractmethod
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        """Store data under key, replacing any existing object."""
+    
+    @abstractmethod
+    async def put_file(self, key: str, path: Path, content_type: str) -> None:
+        """Like put(), but copies the file at path without reading it into memory."""
+    
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        """Size, modification time and ETag of a stored object, or None if missing."""
+    
+    @abstractmethod
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        """Bytes start..end (inclusive) of a stored object; the whole object by default."""
+    
+    @abstractmethod
+    async def delete_prefix(self, prefix: str) -> None:
+        """Delete every object whose key starts with prefix."""
+    
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Like read(), but in chunks of at most STORAGE_STREAM_CHUNK_BYTES."""
+        while end is None or start <= end:
+            last = start + STORAGE_STREAM_CHUNK_BYTES - 1
+            chunk = await self.read(key, start, last if end is None else min(last, end))
+            if chunk:
+                yield chunk
+            if len(chunk) < STORAGE_STREAM_CHUNK_BYTES:
+                return
+            start += len(chunk)
+    
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+    
+    def local_path(self, key: str) -> Optional[Path]:
+        """Filesystem path of an object, for drivers that can serve files directly."""
+        return None
+
+class LocalStorage(ImageStorage):
+    def __init__(self, root: Path):
+        self.root = root.resolve()
+    
+    def _path(self, key: str) -> Path:
+        path = self.root.joinpath(*key.split("/")).resolve()
+        if not path.is_relative_to(self.root) or path == self.root:
+            raise ValueError(f"Storage key outside {self.root}: {key}")
+        return path
+    
+    def _replace(self, key: str, write: Callable[[Path], object]) -> None:
+        # Write next to the target and rename, so readers never see a partial file
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    
+    def _read(self, key: str, start: int, end: Optional[int]) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+    
+    def _delete_prefix(self, prefix: str) -> None:
+        directory, _, name = prefix.rpartition("/")
+        parent = self._path(directory) if directory else self.root
+        if not name:
+            shutil.rmtree(parent, ignore_errors=True)
+            return
+        for path in parent.glob(f"{glob.escape(name)}*"):
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+    
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        await asyncio.to_thread(self._replace, key, lambda tmp_path: tmp_path.write_bytes(data))
+    
+    async def put_file(self, key: str, path: Path, content_type: str) -> None:
+        await asyncio.to_thread(self._replace, key, lambda tmp_path: shutil.copyfile(path, tmp_path))
+    
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat_result = self._path(key).stat()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not stat.S_ISREG(stat_result.st_mode):
+            return None
+        return StoredObject(
+            stat_result.st_size, stat_result.st_mtime, compute_etag([stat_result.st_mtime_ns, stat_result.st_size])
+        )
+    
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return await asyncio.to_thread(self._read, key, start, end)
+    
+    async def delete_prefix(self, prefix: str) -> None:
+        await asyncio.to_thread(self._delete_prefix, prefix)
+    
+    def local_path(self, key: str) -> Optional[Path]:
+        return self._path(key)
+
+class S3Storage(ImageStorage):
+    """S3-compatible bucket; boto3 calls run on worker threads.
+    
+    Works with any endpoint speaking the S3 API, including MinIO and moto's
+    server mode for local testing (set S3_ENDPOINT_URL).
+    """
+    
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 key_prefix: str = "", max_connections: int = S3_MAX_CONNECTIONS):
+        import boto3
+        from botocore.config import Config
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            config=Config(max_pool_connections=max_connections, retries={"mode": "standard"}),
+        )
+    
+    def _get(self, key: str, start: int, end: Optional[int]):
+        kwargs = {"Range": f"bytes={start}-{'' if end is None else end}"} if start or end is not None else {}
+        return self.client.get_object(Bucket=self.bucket, Key=self.key_prefix + key, **kwargs)["Body"]
+    
+    def _read(self, key: str, start: int, end: Optional[int]) -> bytes:
+        with self._get(key, start, end) as body:
+            return body.read()
+    
+    def _delete_prefix(self, prefix: str) -> None:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.key_prefix + prefix):
+            objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+    
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        await asyncio.to_thread(
+            self.client.put_object, Bucket=self.bucket, Key=self.key_prefix + key, Body=data, ContentType=content_type
+        )
+    
+    async def put_file(self, key: str, path: Path, content_type: str) -> None:
+        # upload_file streams from disk (in parts, for large files)
+        await asyncio.to_thread(
+            self.client.upload_file, str(path), self.bucket, self.key_prefix + key,
+            ExtraArgs={"ContentType": content_type},
+        )
+    
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.key_prefix + key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObject(head["ContentLength"], head["LastModified"].timestamp(), head["ETag"])
+    
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> bytes:
+        return await asyncio.to_thread(self._read, key, start, end)
+    
+    async def stream(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        # One GET, read off the response body a chunk at a time
+        body = await asyncio.to_thread(self._get, key, start, end)
+        try:
+            chunks = body.iter_chunks(STORAGE_STREAM_CHUNK_BYTES)
+            while chunk := await asyncio.to_thread(next, chunks, b""):
+                yield chunk
+        finally:
+            body.close()
+    
+    async def delete_prefix(self, prefix: str) -> None:
+        await asyncio.to_thread(self._delete_prefix, prefix)
+
+def create_storage() -> ImageStorage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(UPLOAD_DIR)
+    if STORAGE_BACKEND == "s3":
+        if not S3_BUCKET:
+            raise RuntimeError("S3_BUCKET must be set when STORAGE_BACKEND=s3")
+        return S3Storage(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION, S3_KEY_PREFIX)
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+storage = create_storage()
+
+_image_executor = None
+image_slots = asyncio.Semaphore(IMAGE_QUEUE_LIMIT)
+
+def get_image_executor() -> ProcessPoolExecutor:
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _image_executor
+
+async def acquire_image_slot() -> bool:
+    """Take one of the image_slots, waiting at most IMAGE_QUEUE_TIMEOUT.
+    
+    The caller must release the slot if this returns True.
+    """
+    acquired = False
+    try:
+        async with asyncio.timeout(IMAGE_QUEUE_TIMEOUT):
+            await image_slots.acquire()
+            acquired = True
+    except BaseException as e:
+        # A timeout or cancellation landing just after the acquire must not leak the slot
+        if acquired:
+            image_slots.release()
+        if isinstance(e, TimeoutError):
+            return False
+        raise
+    return True
+
+async def run_image_task(fn, *args):
+    """Run CPU-bound image work on the pool for a request.
+    
+    Waits at most IMAGE_QUEUE_TIMEOUT for one of the image_slots (503 after
+    that); rejected or undecodable images become 400s.
+    """
+    if not await acquire_image_slot():
+        raise HTTPException(status_code=503, detail="Image processing is busy, please retry")
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_image_executor(), fn, *args)
+    except ImageRejected as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+    except OSError:
+        raise HTTPException(status_code=400, detail="Invalid image: unsupported or corrupt image file")
+    finally:
+        image_slots.release()
+
+async def spool_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> tuple:
+    """Copy an upload to a temp file in chunks, enforcing max_bytes.
+    
+    The request body was already received (and capped) by RequestSizeLimit;
+    this enforces the per-file limit. Returns the temp file path and the
+    SHA-256 of the original bytes.
+    """
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"Image exceeds the {max_bytes // (1024 * 1024)}MB upload limit"
+    )
+    if upload.size is not None and upload.size > max_bytes:
+        raise too_large
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=UPLOAD_TMP_DIR)
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise too_large
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return Path(path), digest.hexdigest()
+
+def probe_image(source: Union[bytes, str, Path]) -> str:
+    """Format of an upload, checked (including the pixel limit) without decoding it."""
+    with open_image(source, MAX_IMAGE_DIMENSION) as img:
+        return img.format
+
+def original_key(original_hash: str, image_format: str) -> str:
+    return f"{ORIGINALS_PREFIX}/{original_hash}.{ORIGINAL_EXTENSIONS.get(image_format, 'bin')}"
+
+async def store_original(path: Path, key: str) -> None:
+    await storage.put_file(key, path, IMAGE_MEDIA_TYPES.get(Path(key).suffix, "application/octet-stream"))
+
+async def store_uploads(uploads: List[UploadFile]) -> tuple:
+    """Accept the images of one upload without compressing them.
+    
+    Uploads whose original bytes were processed before resolve to their blob
+    right away (taking a reference on it). The rest are stored as originals
+    and returned as `/api/images/originals/...` URLs; once the listing that
+    references them is saved, pass the returned jobs to enqueue_image_jobs()
+    and a worker swaps in the processed blob. Returns the image URLs (in
+    input order), the jobs and the elapsed time in ms.
+    """
+    started = time.perf_counter()
+    spooled = []
+    try:
+        for upload in uploads:
+            spooled.append(await spool_upload(upload))
+        try:
+            formats = await asyncio.gather(*(asyncio.to_thread(probe_image, path) for path, _ in spooled))
+        except ImageRejected as e:
+            raise HTTPException(status_code=400, detail=f"Invalid image: {e}")
+        original_hashes = list({original_hash: None for _, original_hash in spooled})
+        known = {
+            doc["original_hash"]: doc["hash"]
+            async for doc in db.image_originals.find({"original_hash": {"$in": original_hashes}})
+        }
+        references = Counter(known[h] for _, h in spooled if h in known)
+        reused = dict(zip(references, await asyncio.gather(
+            *(reuse_blob(content_hash, count) for content_hash, count in references.items())
+        )))
+        reusable = {h for h, content_hash in known.items() if reused[content_hash]}
+        jobs, sources = {}, {}
+        for (path, original_hash), image_format in zip(spooled, formats):
+            if original_hash not in reusable and original_hash not in jobs:
+                jobs[original_hash] = original_key(original_hash, image_format)
+                sources[original_hash] = path
+        try:
+            # One at a time: each is a full-size upload, and requests already run concurrently
+            for original_hash, key in jobs.items():
+                await store_original(sources[original_hash], key)
+        except BaseException:
+            await release_images([blob_url(known[h]) for _, h in spooled if h in reusable])
+            raise
+    finally:
+        for path, _ in spooled:
+            path.unlink(missing_ok=True)
+    
+    urls = [
+        blob_url(known[h]) if h in reusable else f"/api/images/{jobs[h]}"
+        for _, h in spooled
+    ]
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"Accepted {len(uploads)} images ({len(jobs)} queued for processing, "
+        f"{len(uploads) - sum(1 for _, h in spooled if h in jobs)} deduplicated) in {elapsed_ms:.0f} ms"
+    )
+    return urls, list(jobs.items()), elapsed_ms
+
+async def reference_blob(content_hash: str, count: int = 1) -> bool:
+    """Take references on a blob's record, creating it if needed.
+    
+    False (taking nothing) while the blob is being deleted: its files may
+    disappear any moment, so the caller must not use or rewrite them yet.
+    """
+    stale = datetime.now(timezone.utc) - timedelta(seconds=BLOB_DELETE_STALE_SECONDS)
+    try:
+        await db.image_blobs.update_one(
+            {"hash": content_hash, "$or": [{"deleting_at": None}, {"deleting_at": {"$lt": stale}}]},
+            {"$inc": {"refcount": count}, "$unset": {"deleting_at": ""}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def reuse_blob(content_hash: str, count: int) -> bool:
+    """Take references on an already processed blob, if its files are there.
+    
+    The reference comes first, so a concurrent release can no longer delete
+    the files between checking them and using the blob.
+    """
+    if not await reference_blob(content_hash, count):
+        return False
+    if await storage.exists(blob_key(content_hash)):
+        return True
+    await release_blob(content_hash, count)
+    return False
+
+async def release_blob(content_hash: str, count: int = 1) -> None:
+    """Drop references on a blob, deleting it once nobody uses it anymore."""
+    await db.image_blobs.update_one({"hash": content_hash}, {"$inc": {"refcount": -count}})
+    deleting_at = datetime.now(timezone.utc)
+    claimed = await db.image_blobs.find_one_and_update(
+        {"hash": content_hash, "refcount": {"$lte": 0}, "deleting_at": None},
+        {"$set": {"deleting_at": deleting_at}},
+    )
+    if not claimed:
+        return
+    await db.image_originals.delete_many({"hash": content_hash})
+    # Every rendition and cached format variant shares the hash prefix
+    await storage.delete_prefix(f"{BLOB_PREFIX}/{content_hash}")
+    await db.image_blobs.delete_one({"hash": content_hash, "deleting_at": deleting_at})
+
+async def release_images(urls: List[str]) -> None:
+    """Drop one reference per blob image URL, deleting blobs nobody uses anymore."""
+    references = Counter(content_hash for content_hash in map(blob_hash, urls) if content_hash)
+    for content_hash, count in references.items():
+        await release_blob(content_hash, count)
+
+def _new_image_job(key: str) -> dict:
+    return {"original_key": key, "status": "pending", "attempts": 0, "created_at": datetime.now(timezone.utc)}
+
+async def enqueue_image_jobs(jobs: List[tuple]) -> None:
+    """Queue processing for stored originals, after the listing referencing them is saved.
+    
+    Bumping `requests` on a job that is already running makes its worker
+    run it once more, so listings saved mid-run still get the blob.
+    """
+    for original_hash, key in jobs:
+        await db.image_jobs.update_one(
+            {"original_hash": original_hash},
+            {"$setOnInsert": _new_image_job(key), "$inc": {"requests": 1}},
+            upsert=True,
+        )
+    if jobs:
+        image_jobs_wakeup.set()
+
+async def claim_image_job() -> Optional[dict]:
+    """Lease the oldest pending job, or one whose previous lease expired."""
+    now = datetime.now(timezone.utc)
+    return await db.image_jobs.find_one_and_update(
+        {"$or": [{"status": "pending"}, {"status": "processing", "locked_until": {"$lt": now}}]},
+        {
+            "$set": {"status": "processing", "locked_until": now + timedelta(seconds=IMAGE_JOB_LEASE_SECONDS)},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+async def render_original(job: dict) -> str:
+    """Content hash of the blob for a job's original, rendering it if needed.
+    
+    Returns holding a reference on the blob, so it can't be deleted before
+    the listings point at it; the caller releases it afterwards.
+    """
+    mapping = await db.image_originals.find_one({"original_hash": job["original_hash"]})
+    if mapping and await reuse_blob(mapping["hash"], 1):
+        return mapping["hash"]
+    data = await storage.read(job["original_key"])
+    async with image_slots:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        renditions = await loop.run_in_executor(get_image_executor(), render_image, data)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"Rendered image {job['original_hash']} "
+        f"({len(data)} -> {sum(map(len, renditions.values()))} bytes) in {elapsed_ms:.0f} ms"
+    )
+    content_hash = hashlib.sha256(renditions["full"]).hexdigest()
+    # Reference before writing: a deletion in progress would remove the new files
+    if not await reference_blob(content_hash):
+        raise RuntimeError(f"Blob {content_hash} is being deleted")
+    try:
+        await write_blob(content_hash, renditions)
+        await db.image_originals.update_one(
+            {"original_hash": job["original_hash"]}, {"$set": {"hash": content_hash}}, upsert=True
+        )
+    except BaseException:
+        await release_blob(content_hash)
+        raise
+    return content_hash
+
+async def swap_image_references(source_url: str, content_hash: str) -> None:
+    """Point every listing image at source_url to the processed blob instead.
+    
+    The caller must hold a reference on the blob (see render_original).
+    """
+    target = blob_url(content_hash)
+    projection = {"_id": 0, "id": 1, "images": 1, "version": 1}
+    async for listing in db.listings.find({"images": source_url}, projection):
+        # Optimistic on `version`: an edit in between means re-reading the images
+        while listing:
+            count = listing["images"].count(source_url)
+            await db.image_blobs.update_one({"hash": content_hash}, {"$inc": {"refcount": count}})
+            result = await db.listings.update_one(
+                {"id": listing["id"], "version": listing.get("version")},
+                {
+                    "$set": {"images": [target if url == source_url else url for url in listing["images"]]},
+                    "$inc": {"version": 1},
+                },
+            )
+            if result.modified_count:
+                break
+            await release_blob(content_hash, count)
+            listing = await db.listings.find_one({"id": listing["id"], "images": source_url}, projection)
+
+async def finish_image_job(job: dict) -> None:
+    # Only drop the job (and its original) if nobody re-queued it meanwhile
+    result = await db.image_jobs.delete_one({"_id": job["_id"], "requests": job["requests"]})
+    if result.deleted_count:
+        await storage.delete_prefix(job["original_key"])
+    else:
+        await release_image_job(job)
+
+async def fail_image_job(job: dict, error: str) -> None:
+    """Give up on an image: remove it from its listings and record why."""
+    source_url = f"/api/images/{job['original_key']}"
+    logger.warning(f"Image {job['original_hash']} failed after {job['attempts']} attempts: {error}")
+    await db.listings.update_many(
+        {"images": source_url},
+        {"$pull": {"images": source_url}, "$push": {"image_errors": error}, "$inc": {"version": 1}},
+    )
+    await db.image_jobs.delete_one({"_id": job["_id"]})
+    await storage.delete_prefix(job["original_key"])
+
+async def process_image_job(job: dict) -> None:
+    source_url = f"/api/images/{job['original_key']}"
+    if not await db.listings.find_one({"images": source_url}, {"_id": 1}):
+        # Listing deleted (or image removed) before processing
+        await finish_image_job(job)
+        return
+    try:
+        content_hash = await render_original(job)
+    except ImageRejected as e:
+        await fail_image_job(job, f"Invalid image: {e}")
+        return
+    try:
+        await swap_image_references(source_url, content_hash)
+    finally:
+        await release_blob(content_hash)
+    await finish_image_job(job)
+
+async def release_image_job(job: dict) -> None:
+    await db.image_jobs.update_one({"_id": job["_id"]}, {"$set": {"status": "pending", "locked_until": None}})
+
+image_jobs_wakeup = asyncio.Event()
+_image_job_tasks = []
+
+async def image_job_worker() -> None:
+    """Process image jobs until cancelled, polling for work queued by other instances."""
+    while True:
+        image_jobs_wakeup.clear()
+        try:
+            job = await claim_image_job()
+        except Exception as e:
+            logger.error(f"Could not claim image job: {e}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(image_jobs_wakeup.wait(), timeout=IMAGE_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await process_image_job(job)
+        except asyncio.CancelledError:
+            # Hand the job back instead of waiting for the lease to expire
+            await release_image_job(job)
+            raise
+        except Exception as e:
+            try:
+                await retry_image_job(job, e)
+            except Exception as e:
+                logger.error(f"Could not update image job {job['original_hash']}: {e}")
+
+async def retry_image_job(job: dict, error: Exception) -> None:
+    """Back off before the next attempt (by extending the lease), or give up."""
+    if job["attempts"] >= IMAGE_JOB_MAX_ATTEMPTS:
+        logger.error(f"Image job {job['original_hash']} failed", exc_info=error)
+        await fail_image_job(job, "Image could not be processed")
+        return
+    logger.warning(f"Image job {job['original_hash']} attempt {job['attempts']} failed, will retry: {error}")
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=IMAGE_JOB_RETRY_SECONDS * 2 ** (job["attempts"] - 1))
+    await db.image_jobs.update_one({"_id": job["_id"]}, {"$set": {"locked_until": retry_at}})
+
+async def requeue_orphaned_originals() -> int:
+    """Queue jobs for listings still showing originals that have no job (e.g. after a crash)."""
+    prefix = f"/api/images/{ORIGINALS_PREFIX}/"
+    urls = await db.listings.distinct("images", {"images": {"$regex": f"^{re.escape(prefix)}"}})
+    count = 0
+    for url in urls:
+        if not url.startswith(prefix):
+            continue
+        key = url[len("/api/images/"):]
+        original_hash = key.rpartition("/")[2].partition(".")[0]
+        result = await db.image_jobs.update_one(
+            {"original_hash": original_hash},
+            {"$setOnInsert": {**_new_image_job(key), "requests": 1}},
+            upsert=True,
+        )
+        count += bool(result.upserted_id)
+    return count
 
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
@@ -82,12 +964,208 @@ api_router = APIRouter(prefix="/api")
 # Serve images via API instead of static mount for cross-origin support
 from fastapi.responses import FileResponse
 
+def negotiate_image_variant(accept: Optional[str]) -> Optional[tuple]:
+    """Pick the preferred entry of IMAGE_VARIANTS allowed by an Accept header."""
+    if not accept:
+        return None
+    accepted = set()
+    for part in accept.split(","):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        if any(p.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for p in params):
+            continue
+        accepted.add(media_type.lower())
+    for variant in IMAGE_VARIANTS:
+        if variant[0] in accepted:
+            return variant
+    return None
+
+async def transcode_variant(key: str, variant_key: str, variant: tuple) -> None:
+    """Cache a format variant of an image, or an empty marker if it isn't smaller."""
+    media_type, _, image_format, options = variant
+    if not await acquire_image_slot():
+        return
+    try:
+        source = await storage.read(key)
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(get_image_executor(), transcode_image, source, image_format, options)
+        await storage.put(variant_key, data if len(data) < len(source) else b"", media_type)
+    except Exception as e:
+        logger.warning(f"Could not create {media_type} variant of {key}: {e}")
+    finally:
+        image_slots.release()
+
+_variant_tasks = {}
+
+async def image_variant(key: str, variant: tuple) -> Optional[tuple]:
+    """(key, StoredObject) of a cached format variant of an image worth serving.
+    
+    None means serve the JPEG: the variant isn't smaller, or is still missing,
+    in which case it is transcoded in the background for later requests.
+    """
+    variant_key = f"{key.rpartition('.')[0]}.{variant[1]}"
+    stored = await storage.stat(variant_key)
+    if stored:
+        return (variant_key, stored) if stored.size else None
+    if variant_key not in _variant_tasks and len(_variant_tasks) < IMAGE_VARIANT_BACKLOG:
+        task = asyncio.create_task(transcode_variant(key, variant_key, variant))
+        _variant_tasks[variant_key] = task
+        task.add_done_callback(lambda _: _variant_tasks.pop(variant_key, None))
+    return None
+
+def image_key(*segments: str) -> str:
+    """Storage key of an image route's path segments; 404s for anything unsafe."""
+    if not all(IMAGE_PATH_SEGMENT.match(segment) and ".." not in segment for segment in segments):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return "/".join(segments)
+
+def parse_byte_range(range_header: str, size: int) -> Optional[tuple]:
+    """(start, end) of a single `bytes=` range, inclusive; None to send the whole file.
+    
+    Multi-range and malformed headers are ignored (RFC 9110 allows that);
+    ranges that start past the end of the file get 416.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start, _, end = spec.strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return None
+            first, last = max(size - suffix, 0), size - 1
+        else:
+            first = int(start)
+            last = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size:
+        raise HTTPException(
+            status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"}
+        )
+    if first > last:
+        return None
+    return first, last
+
+async def image_file_response(
+    key: str,
+    stored: StoredObject,
+    request_headers: dict,
+    immutable: bool,
+    media_type: Optional[str] = None,
+    headers: Optional[dict] = None,
+) -> Response:
+    """Serve a stored image with caching validators, 304s and single byte ranges."""
+    last_modified = formatdate(stored.modified, usegmt=True)
+    headers = {
+        **(headers or {}),
+        "ETag": stored.etag,
+        "Last-Modified": last_modified,
+        "Cache-Control": IMAGE_IMMUTABLE_CACHE_CONTROL if immutable else IMAGE_REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "X-Content-Type-Options": "nosniff",
+    }
+    
+    if_none_match = request_headers.get("if_none_match")
+    if_modified_since = request_headers.get("if_modified_since")
+    if if_none_match:
+        if etag_matches(if_none_match, stored.etag):
+            return Response(status_code=304, headers=headers)
+    elif if_modified_since:
+        try:
+            if int(stored.modified) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return Response(status_code=304, headers=headers)
+        except (TypeError, ValueError):
+            pass
+    
+    media_type = media_type or IMAGE_MEDIA_TYPES.get(Path(key).suffix.lower(), "application/octet-stream")
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if_range")
+    if range_header and (not if_range or if_range in (stored.etag, last_modified)):
+        byte_range = parse_byte_range(range_header, stored.size)
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stored.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                storage.stream(key, start, end), status_code=206, media_type=media_type, headers=headers
+            )
+    local_path = storage.local_path(key)
+    if local_path:
+        return FileResponse(local_path, media_type=media_type, headers=headers)
+    # Don't hold whole objects from remote storage in memory
+    headers["Content-Length"] = str(stored.size)
+    return StreamingResponse(storage.stream(key), media_type=media_type, headers=headers)
+
+def conditional_image_headers(
+    if_none_match: Optional[str] = Header(None),
+    if_modified_since: Optional[str] = Header(None),
+    range: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+) -> dict:
+    return {
+        "if_none_match": if_none_match,
+        "if_modified_since": if_modified_since,
+        "range": range,
+        "if_range": if_range,
+    }
+
+# Declared before the listing image route, which would otherwise match it
+@api_router.get("/images/avatars/{filename}")
+async def get_avatar_image(
+    filename: str,
+    v: Optional[str] = None,
+    request_headers: dict = Depends(conditional_image_headers),
+):
+    key = image_key("avatars", filename)
+    stored = await storage.stat(key)
+    if not stored:
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    # Current avatars are versioned by file name, older ones by `?v=`
+    immutable = bool(v or AVATAR_VERSIONED_FILENAME.search(filename))
+    return await image_file_response(key, stored, request_headers, immutable=immutable)
+
 @api_router.get("/images/{listing_id}/{filename}")
-async def get_image(listing_id: str, filename: str):
-    file_path = UPLOAD_DIR / listing_id / filename
-    if not file_path.exists():
+async def get_image(
+    listing_id: str,
+    filename: str,
+    size: str = "full",
+    accept: Optional[str] = Header(None),
+    request_headers: dict = Depends(conditional_image_headers),
+):
+    if size not in IMAGE_RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"size must be one of: {', '.join(IMAGE_RENDITIONS)}")
+    if listing_id == ORIGINALS_PREFIX:
+        # Unprocessed upload whose job is still running; replaced by a blob soon.
+        # The original itself is never sent: it can be MAX_UPLOAD_BYTES, in any
+        # orientation, and still carries the camera's EXIF (including GPS).
+        if not await storage.exists(image_key(listing_id, filename)):
+            raise HTTPException(status_code=404, detail="Image not found")
+        return Response(
+            content=pending_image_placeholder(size), media_type="image/jpeg",
+            headers={"Cache-Control": "no-store", "X-Content-Type-Options": "nosniff"},
+        )
+    
+    key = image_key(listing_id, rendition_filename(filename, size))
+    stored = await storage.stat(key)
+    if not stored and size != "full":
+        # Images uploaded before renditions existed only have the full file
+        key = image_key(listing_id, filename)
+        stored = await storage.stat(key)
+    if not stored:
         raise HTTPException(status_code=404, detail="Image not found")
-    return FileResponse(file_path, media_type="image/jpeg")
+    
+    # Blobs are named by their content hash and never change; images in
+    # pre-blob-store listing folders could be overwritten, so revalidate those
+    immutable = listing_id == BLOB_PREFIX
+    # Serve WebP/AVIF to browsers that accept them; caches must key on Accept
+    headers = {"Vary": "Accept"}
+    variant = negotiate_image_variant(accept)
+    if variant:
+        cached = await image_variant(key, variant)
+        if cached:
+            return await image_file_response(*cached, request_headers, immutable, variant[0], headers)
+    return await image_file_response(key, stored, request_headers, immutable, "image/jpeg", headers)
 
 # Pydantic Models
 class UserCreate(BaseModel):
@@ -147,6 +1225,36 @@ class CarListingResponse(BaseModel):
     user_avatar: Optional[str] = None
     favorite_count: int = 0
     clean_title: bool = False
+    distance_miles: Optional[float] = None
+    relevance: Optional[float] = None
+    image_errors: List[str] = []
+
+    @computed_field
+    @property
+    def image_renditions(self) -> List[dict]:
+        """Per-image URLs of the thumb/card/full renditions, same order as `images`."""
+        return [image_rendition_urls(path) for path in self.images]
+
+    @computed_field
+    @property
+    def image_status(self) -> str:
+        """`processing` while any image is still an unprocessed original."""
+        return "processing" if pending_image_count(self.images) else "ready"
+
+class ListingFilters(BaseModel):
+    q: Optional[str] = None
+    make: Optional[str] = None
+    model: Optional[str] = None
+    year_from: Optional[int] = None
+    year_to: Optional[int] = None
+    mileage_from: Optional[int] = None
+    mileage_to: Optional[int] = None
+    price_from: Optional[int] = None
+    price_to: Optional[int] = None
+    drive_type: Optional[str] = None
+    zip_code: Optional[str] = None
+    distance: Optional[int] = None
+    clean_title: Optional[bool] = None
 
 class CarListingUpdate(BaseModel):
     make: Optional[str] = None
@@ -170,6 +1278,104 @@ def hash_password(password: str) -> str:
 def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+class AdmissionGate:
+    """Concurrency limit with a bounded, time-limited wait queue.
+    
+    Requests that find the queue full, or wait longer than `timeout` for a
+    slot, are shed with 429 so a burst can't pile up unbounded work.
+    """
+
+    def __init__(self, limit: int, queue_limit: int, timeout: float, retry_after: int):
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def _reject(self) -> HTTPException:
+        self.shed += 1
+        return HTTPException(
+            status_code=429,
+            detail="Too many authentication requests, please retry shortly",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def __aenter__(self):
+        if self._slots.locked() and self.waiting >= self.queue_limit:
+            raise self._reject()
+        self.waiting += 1
+        acquired = False
+        try:
+            async with asyncio.timeout(self.timeout):
+                await self._slots.acquire()
+                acquired = True
+        except BaseException as e:
+            # A timeout or cancellation landing just after the acquire must not leak the slot
+            if acquired:
+                self._slots.release()
+            if isinstance(e, TimeoutError):
+                raise self._reject() from None
+            raise
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        self.admitted += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "limit": self.limit,
+            "queue_limit": self.queue_limit,
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+auth_gate = AdmissionGate(AUTH_CONCURRENCY, AUTH_QUEUE_LIMIT, AUTH_QUEUE_TIMEOUT, AUTH_RETRY_AFTER_SECONDS)
+hash_latencies_ms = deque(maxlen=HASH_LATENCY_SAMPLES)
+_password_executor = None
+
+def get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _password_executor
+
+def _timed_bcrypt(fn, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        hash_latencies_ms.append((time.perf_counter() - started) * 1000)
+
+async def run_bcrypt(fn, *args):
+    """Run hash_password/verify_password on the password pool, recording its latency."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_password_executor(), _timed_bcrypt, fn, *args)
+
+def latency_summary(samples) -> dict:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1)
+    return {
+        "count": len(ordered),
+        "avg": round(sum(ordered) / len(ordered), 1),
+        "p50": percentile(0.5),
+        "p95": percentile(0.95),
+        "max": round(ordered[-1], 1),
+    }
+
 def create_token(user_id: str) -> str:
     payload = {
         "user_id": user_id,
@@ -177,16 +1383,273 @@ def create_token(user_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def avatar_url(user: Optional[dict], size: str = "full") -> Optional[str]:
+    """URL of a user's avatar rendition; avatars uploaded before renditions only have `avatar`."""
+    if not user:
+        return None
+    return (user.get("avatar_renditions") or {}).get(size) or user.get("avatar")
+
+def listing_enrichment_stages() -> list:
+    """Aggregation stages that attach seller info to listings."""
+    return [
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "name": 1, "nickname": 1, "avatar": 1, "avatar_renditions": 1}}],
+            "as": "_seller",
+        }},
+        {"$addFields": {"_seller": {"$ifNull": [{"$arrayElemAt": ["$_seller", 0]}, {}]}}},
+        {"$addFields": {
+            "user_name": {"$cond": [
+                {"$ne": [{"$ifNull": ["$_seller.nickname", ""]}, ""]},
+                "$_seller.nickname",
+                {"$ifNull": ["$_seller.name", "Unknown"]},
+            ]},
+            "user_avatar": {"$ifNull": ["$_seller.avatar_renditions.card", "$_seller.avatar"]},
+            "favorite_count": {"$ifNull": ["$favorite_count", 0]},
+        }},
+        {"$project": {"_id": 0, "_seller": 0}},
+    ]
+
+class TTLCache:
+    """Small in-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def compute_etag(payload) -> str:
+    """Strong ETag over the JSON serialization of a payload."""
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode('utf-8')
+    return f'"{hashlib.sha1(raw).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header value matches the given ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def listing_etag(listing: dict) -> str:
+    """ETag of an enriched listing: its version plus the joined seller fields."""
+    return compute_etag([
+        listing["id"],
+        listing.get("version", 0),
+        listing.get("user_name"),
+        listing.get("user_avatar"),
+        listing.get("distance_miles"),
+    ])
+
+# Fields listing_etag and the page cursor need, before the seller join
+LISTING_ETAG_PROJECTION = {"_id": 0, "id": 1, "version": 1, "user_id": 1, "created_at": 1, "distance_miles": 1}
+
+async def attach_seller_fields(listings: list) -> None:
+    """Set user_name/user_avatar as listing_enrichment_stages would, with one users query."""
+    user_ids = list({listing["user_id"] for listing in listings})
+    sellers = {
+        user["id"]: user for user in await db.users.find(
+            {"id": {"$in": user_ids}},
+            {"_id": 0, "id": 1, "name": 1, "nickname": 1, "avatar": 1, "avatar_renditions": 1},
+        ).to_list(None)
+    }
+    for listing in listings:
+        seller = sellers.get(listing["user_id"], {})
+        listing["user_name"] = seller.get("nickname") or (seller["name"] if seller.get("name") is not None else "Unknown")
+        listing["user_avatar"] = avatar_url(seller, "card")
+
+def normalize_term(value: str) -> str:
+    """Canonical form of make/model used for indexed matching."""
+    return value.strip().lower()
+
+def prefix_match(value: str) -> dict:
+    """Anchored, case-sensitive prefix regex on a normalized field (index range scan)."""
+    return {"$regex": f"^{re.escape(normalize_term(value))}"}
+
+@lru_cache(maxsize=1)
+def load_zip_centroids() -> dict:
+    """Load the bundled ZIP centroid table into memory (once per process)."""
+    centroids = {}
+    with gzip.open(ZIP_CENTROIDS_FILE, "rt", newline="") as f:
+        for row in csv.DictReader(f):
+            centroids[row["zip"]] = (float(row["lng"]), float(row["lat"]))
+    return centroids
+
+def zip_location(zip_code: Optional[str]) -> Optional[dict]:
+    """GeoJSON point for a ZIP code's centroid, or None if unknown."""
+    if not zip_code:
+        return None
+    coords = load_zip_centroids().get(zip_code.strip()[:5])
+    if not coords:
+        return None
+    return {"type": "Point", "coordinates": list(coords)}
+
+def build_listing_query(filters: ListingFilters) -> tuple:
+    """Translate search filters into a Mongo query plus an optional geo centre."""
+    query = {}
+    
+    if filters.make:
+        query["make_norm"] = prefix_match(filters.make)
+    if filters.model:
+        query["model_norm"] = prefix_match(filters.model)
+    if filters.year_from:
+        query["year"] = {"$gte": filters.year_from}
+    if filters.year_to:
+        query.setdefault("year", {})["$lte"] = filters.year_to
+    if filters.mileage_from:
+        query["mileage"] = {"$gte": filters.mileage_from}
+    if filters.mileage_to:
+        query.setdefault("mileage", {})["$lte"] = filters.mileage_to
+    if filters.price_from:
+        query["price"] = {"$gte": filters.price_from}
+    if filters.price_to:
+        query.setdefault("price", {})["$lte"] = filters.price_to
+    if filters.drive_type:
+        query["drive_type"] = filters.drive_type
+    # With a distance, search a real radius around the ZIP's centroid;
+    # otherwise (or for unknown ZIPs) fall back to the ZIP prefix match
+    geo_point = zip_location(filters.zip_code) if filters.zip_code and filters.distance else None
+    if filters.zip_code and not geo_point:
+        query["zip_code"] = {"$regex": f"^{re.escape(filters.zip_code[:3])}"}
+    if filters.clean_title is not None:
+        query["clean_title"] = filters.clean_title
+    if filters.q and filters.q.strip():
+        query["$text"] = {"$search": filters.q.strip()}
+        # $text can't be combined with $geoNear, so keyword searches filter the
+        # radius with $geoWithin instead and are ranked by relevance
+        if geo_point:
+            query["location"] = {"$geoWithin": {"$centerSphere": [
+                geo_point["coordinates"], filters.distance / EARTH_RADIUS_MILES
+            ]}}
+            geo_point = None
+    
+    return query, geo_point
+
+def geo_near_stage(geo_point: dict, distance: int, query: dict) -> dict:
+    """$geoNear stage selecting listings within `distance` miles, nearest first."""
+    return {"$geoNear": {
+        "near": geo_point,
+        "key": "location",
+        "spherical": True,
+        "maxDistance": distance * METERS_PER_MILE,
+        "distanceField": "distance_miles",
+        "distanceMultiplier": 1 / METERS_PER_MILE,
+        "query": query,
+    }}
+
+def encode_keyset_cursor(sort_value: str, item_id: str) -> str:
+    """Opaque keyset cursor for lists ordered by (timestamp, id) descending."""
+    raw = json.dumps([sort_value, item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_keyset_cursor(cursor: str) -> tuple:
+    try:
+        sort_value, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(sort_value), str(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def encode_listing_cursor(listing: dict) -> str:
+    """Opaque keyset cursor pointing just past the given listing."""
+    return encode_keyset_cursor(listing["created_at"], listing["id"])
+
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+token_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+# Bumped on every invalidation so a lookup that raced a profile write does
+# not put the stale record back into the cache
+_user_cache_generation = 0
+
+def evict_cached_user(user_id: str) -> None:
+    global _user_cache_generation
+    _user_cache_generation += 1
+    user_cache.pop(user_id)
+
+async def invalidate_user(user_id: str) -> None:
+    """Drop a user's cached record here and tell the other workers to do the same."""
+    evict_cached_user(user_id)
+    try:
+        await db.cache_invalidations.insert_one({"user_id": user_id, "at": datetime.now(timezone.utc)})
+    except Exception as e:
+        logger.error(f"Could not broadcast user cache invalidation: {e}")
+
+async def sync_user_cache() -> None:
+    """Apply invalidations published by other workers until cancelled."""
+    since = datetime.now(timezone.utc)
+    while True:
+        await asyncio.sleep(USER_CACHE_SYNC_SECONDS)
+        # Overlap polls so writes committed slightly out of order are not missed
+        checked_at = datetime.now(timezone.utc)
+        try:
+            cursor = db.cache_invalidations.find(
+                {"at": {"$gt": since - timedelta(seconds=USER_CACHE_SYNC_SECONDS)}},
+                {"_id": 0, "user_id": 1},
+            )
+            async for doc in cursor:
+                evict_cached_user(doc["user_id"])
+            since = checked_at
+        except Exception as e:
+            logger.error(f"Could not sync user cache: {e}")
+
+def verify_token(token: str) -> Optional[str]:
+    """User id of a valid JWT. Verified tokens are cached until they expire."""
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, expires_at = cached
+        if expires_at > time.time():
+            return user_id
+        token_cache.pop(token)
+        return None
+    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    user_id = payload.get("user_id")
+    if user_id:
+        token_cache.set(token, (user_id, payload["exp"]))
+    return user_id
+
 async def get_current_user(token: str = None):
     if not token:
         return None
     try:
         if token.startswith("Bearer "):
             token = token[7:]
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
-        return user
+        user_id = verify_token(token)
+        if not user_id:
+            return None
+        user = user_cache.get(user_id)
+        if user is None:
+            generation = _user_cache_generation
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+            if user is None:
+                return None
+            if generation == _user_cache_generation:
+                user_cache.set(user_id, user)
+        return dict(user)
     except:
         return None
 
@@ -204,20 +1667,27 @@ async def get_auth_from_header(authorization: str = Header(None)):
 # Auth Routes
 @api_router.post("/auth/register", response_model=TokenResponse)
 async def register(user_data: UserCreate):
+    already_registered = HTTPException(status_code=400, detail="Email already registered")
     existing = await db.users.find_one({"email": user_data.email})
     if existing:
-        raise HTTPException(status_code=400, detail="Email already registered")
+        raise already_registered
     
+    async with auth_gate:
+        password_hash = await run_bcrypt(hash_password, user_data.password)
     user_id = str(uuid.uuid4())
     user_doc = {
         "id": user_id,
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": password_hash,
         "name": user_data.name,
         "phone": user_data.phone,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # A concurrent registration with this email won since the check above
+        raise already_registered
     
     token = create_token(user_id)
     return TokenResponse(
@@ -234,7 +1704,11 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    async with auth_gate:
+        valid = await run_bcrypt(verify_password, credentials.password, user["password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_token(user["id"])
@@ -257,6 +1731,7 @@ async def get_me(authorization: str = Header(None)):
 # Car Listings Routes
 @api_router.post("/listings", response_model=CarListingResponse)
 async def create_listing(
+    response: Response,
     make: str = Form(...),
     model: str = Form(...),
     year: int = Form(...),
@@ -280,22 +1755,12 @@ async def create_listing(
     if len(description) < 10:
         raise HTTPException(status_code=400, detail="Description must be at least 10 characters")
     
-    # Save images with compression
-    image_paths = []
-    listing_id = str(uuid.uuid4())
-    listing_dir = UPLOAD_DIR / listing_id
-    listing_dir.mkdir(exist_ok=True)
-    
-    for i, img in enumerate(images):
-        content = await img.read()
-        # Compress image to JPEG under 0.5MB
-        compressed = compress_image(content)
-        filename = f"{i}.jpg"
-        file_path = listing_dir / filename
-        with open(file_path, "wb") as f:
-            f.write(compressed)
-        image_paths.append(f"/api/images/{listing_id}/{filename}")
+    # Store the originals; JPEG renditions (full size under 0.5MB) are made
+    # in the background, and images uploaded before reuse their stored result
+    image_paths, image_jobs, elapsed_ms = await store_uploads(images)
+    response.headers["Server-Timing"] = f"image-upload;dur={elapsed_ms:.1f}"
     
+    listing_id = str(uuid.uuid4())
     clean_title_bool = clean_title.lower() == "true"
     
     listing_doc = {
@@ -303,6 +1768,8 @@ async def create_listing(
         "user_id": user["id"],
         "make": make,
         "model": model,
+        "make_norm": normalize_term(make),
+        "model_norm": normalize_term(model),
         "year": year,
         "mileage": mileage,
         "price": price,
@@ -314,79 +1781,181 @@ async def create_listing(
         "description": description,
         "images": image_paths,
         "clean_title": clean_title_bool,
+        "favorite_count": 0,
+        "version": 1,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    await db.listings.insert_one(listing_doc)
+    location = zip_location(zip_code)
+    if location:
+        listing_doc["location"] = location
+    try:
+        await db.listings.insert_one(listing_doc)
+    except BaseException:
+        # Don't leak the references taken on reused blobs
+        await release_images(image_paths)
+        raise
+    await enqueue_image_jobs(image_jobs)
+    if listing_adds_make_model(listing_doc["make_norm"], listing_doc["model_norm"]):
+        invalidate_make_model_cache(listing_doc["make_norm"])
     
     return CarListingResponse(**listing_doc, user_name=user["name"])
 
 @api_router.get("/listings", response_model=List[CarListingResponse])
 async def get_listings(
-    make: Optional[str] = None,
-    model: Optional[str] = None,
-    year_from: Optional[int] = None,
-    year_to: Optional[int] = None,
-    mileage_from: Optional[int] = None,
-    mileage_to: Optional[int] = None,
-    price_from: Optional[int] = None,
-    price_to: Optional[int] = None,
-    drive_type: Optional[str] = None,
-    zip_code: Optional[str] = None,
-    distance: Optional[int] = None,
-    clean_title: Optional[bool] = None,
+    response: Response,
+    filters: ListingFilters = Depends(),
     limit: int = 50,
-    skip: int = 0
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
 ):
-    query = {}
+    query, geo_point = build_listing_query(filters)
     
-    if make:
-        query["make"] = {"$regex": make, "$options": "i"}
-    if model:
-        query["model"] = {"$regex": model, "$options": "i"}
-    if year_from:
-        query["year"] = {"$gte": year_from}
-    if year_to:
-        query.setdefault("year", {})["$lte"] = year_to
-    if mileage_from:
-        query["mileage"] = {"$gte": mileage_from}
-    if mileage_to:
-        query.setdefault("mileage", {})["$lte"] = mileage_to
-    if price_from:
-        query["price"] = {"$gte": price_from}
-    if price_to:
-        query.setdefault("price", {})["$lte"] = price_to
-    if drive_type:
-        query["drive_type"] = drive_type
-    if zip_code:
-        query["zip_code"] = {"$regex": f"^{zip_code[:3]}", "$options": "i"}
-    if clean_title is not None:
-        query["clean_title"] = clean_title
-    
-    listings = await db.listings.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Attach user info and favorite counts
-    for listing in listings:
-        user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1})
-        listing["user_name"] = (user.get("nickname") or user["name"]) if user else "Unknown"
-        listing["user_avatar"] = user.get("avatar") if user else None
-        listing["favorite_count"] = await db.favorites.count_documents({"listing_id": listing["id"]})
+    if geo_point:
+        # Radius results are ordered by distance, so they page with skip only
+        pipeline = [geo_near_stage(geo_point, filters.distance, query)]
+        if skip:
+            pipeline.append({"$skip": skip})
+    elif "$text" in query:
+        # Keyword results are ordered by relevance, so they page with skip only
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"relevance": {"$meta": "textScore"}, "created_at": -1, "id": -1}},
+            {"$addFields": {"relevance": {"$meta": "textScore"}}},
+        ]
+        if skip:
+            pipeline.append({"$skip": skip})
+    else:
+        # Keyset pagination: resume strictly after the (created_at, id) of the
+        # previous page's last item, so deep pages cost the same as the first.
+        # `skip` is still honoured for older clients that don't send a cursor.
+        if cursor:
+            created_at, listing_id = decode_keyset_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": listing_id}},
+            ]
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"created_at": -1, "id": -1}},
+        ]
+        if skip and not cursor:
+            pipeline.append({"$skip": skip})
+    
+    pipeline.append({"$limit": limit})
+    pages_by_cursor = not geo_point and "$text" not in query
     
+    def page_headers(page: list) -> dict:
+        headers = {"Cache-Control": "no-cache"}
+        if pages_by_cursor and page and len(page) == limit:
+            headers["X-Next-Cursor"] = encode_listing_cursor(page[-1])
+        # Every listing mutation bumps `version`, so the page's ETag can be
+        # taken from versions (plus the joined seller fields) alone
+        headers["ETag"] = compute_etag([listing_etag(listing) for listing in page])
+        return headers
+    
+    if if_none_match:
+        # Revalidation: select the same page projected to its ETag inputs and
+        # only run the seller join if it changed
+        keys = await db.listings.aggregate(pipeline + [{"$project": LISTING_ETAG_PROJECTION}]).to_list(limit)
+        await attach_seller_fields(keys)
+        headers = page_headers(keys)
+        if etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    
+    # Seller info and favorite counts are joined server-side, so a page of
+    # results costs a single round trip regardless of its size.
+    listings = await db.listings.aggregate(pipeline + listing_enrichment_stages()).to_list(limit)
+    response.headers.update(page_headers(listings))
     return listings
 
+facets_cache = TTLCache(maxsize=512, ttl=FACETS_CACHE_TTL_SECONDS)
+
+def _bands(rows: list, boundaries: list) -> list:
+    """Turn $bucket output into [{min, max, count}] ranges."""
+    result = []
+    for row in rows:
+        if row["_id"] == "other":
+            result.append({"min": boundaries[-1], "max": None, "count": row["count"]})
+        else:
+            idx = boundaries.index(row["_id"])
+            result.append({"min": row["_id"], "max": boundaries[idx + 1], "count": row["count"]})
+    return result
+
+@api_router.get("/listings/facets")
+async def get_listing_facets(filters: ListingFilters = Depends()):
+    """Facet counts and price/mileage histograms for the current search filters."""
+    # Normalize so equivalent filter sets share one cache entry
+    key_filters = filters.model_dump(exclude_none=True)
+    for field in ("make", "model"):
+        if field in key_filters:
+            key_filters[field] = normalize_term(key_filters[field])
+    cache_key = tuple(sorted(key_filters.items()))
+    cached = facets_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    query, geo_point = build_listing_query(filters)
+    pipeline = [geo_near_stage(geo_point, filters.distance, query)] if geo_point else [{"$match": query}]
+    pipeline.append({"$facet": {
+        "total": [{"$count": "count"}],
+        "makes": [{"$sortByCount": "$make_norm"}],
+        "models": [{"$sortByCount": "$model_norm"}],
+        "drive_types": [{"$sortByCount": "$drive_type"}],
+        "clean_title": [{"$sortByCount": "$clean_title"}],
+        "price_bands": [{"$bucket": {"groupBy": "$price", "boundaries": PRICE_BANDS, "default": "other"}}],
+        "year_ranges": [{"$bucket": {"groupBy": "$year", "boundaries": YEAR_RANGES, "default": "other"}}],
+        "price_histogram": [{"$bucketAuto": {"groupBy": "$price", "buckets": HISTOGRAM_BUCKETS}}],
+        "mileage_histogram": [{"$bucketAuto": {"groupBy": "$mileage", "buckets": HISTOGRAM_BUCKETS}}],
+    }})
+    rows = await db.listings.aggregate(pipeline).to_list(1)
+    facets = rows[0] if rows else {}
+    
+    def counts(name: str, title: bool = False) -> list:
+        return [
+            {"value": row["_id"].title() if title else row["_id"], "count": row["count"]}
+            for row in facets.get(name, []) if row["_id"] is not None
+        ]
+    
+    def histogram(name: str) -> list:
+        return [
+            {"min": row["_id"]["min"], "max": row["_id"]["max"], "count": row["count"]}
+            for row in facets.get(name, [])
+        ]
+    
+    total = facets.get("total") or [{"count": 0}]
+    result = {
+        "total": total[0]["count"],
+        "makes": counts("makes", title=True),
+        "models": counts("models", title=True),
+        "drive_types": counts("drive_types"),
+        "clean_title": counts("clean_title"),
+        "price_bands": _bands(facets.get("price_bands", []), PRICE_BANDS),
+        "year_ranges": _bands(facets.get("year_ranges", []), YEAR_RANGES),
+        "price_histogram": histogram("price_histogram"),
+        "mileage_histogram": histogram("mileage_histogram"),
+    }
+    facets_cache.set(cache_key, result)
+    return result
+
 @api_router.get("/listings/{listing_id}", response_model=CarListingResponse)
-async def get_listing(listing_id: str):
-    listing = await db.listings.find_one({"id": listing_id}, {"_id": 0})
+async def get_listing(listing_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    # Conditional requests only need the version, not the whole document
+    projection = {"_id": 0, "id": 1, "user_id": 1, "version": 1} if if_none_match else {"_id": 0}
+    listing = await db.listings.find_one({"id": listing_id}, projection)
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found")
     
-    user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1})
+    user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1, "avatar_renditions": 1})
     listing["user_name"] = (user.get("nickname") or user["name"]) if user else "Unknown"
-    listing["user_avatar"] = user.get("avatar") if user else None
-
-    # Favorite count for this listing
-    fav_count = await db.favorites.count_documents({"listing_id": listing_id})
-    listing["favorite_count"] = fav_count
+    listing["user_avatar"] = avatar_url(user, "card")
     
+    headers = {"ETag": listing_etag(listing), "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if if_none_match:
+        listing.update(await db.listings.find_one({"id": listing_id}, {"_id": 0}) or {})
+    response.headers.update(headers)
     return listing
 
 @api_router.get("/my-listings", response_model=List[CarListingResponse])
@@ -401,18 +1970,69 @@ async def get_my_listings(authorization: str = Header(None)):
 async def update_listing(listing_id: str, update_data: CarListingUpdate, authorization: str = Header(None)):
     user = await require_auth(authorization)
     
-    listing = await db.listings.find_one({"id": listing_id, "user_id": user["id"]}, {"_id": 0})
-    if not listing:
-        raise HTTPException(status_code=404, detail="Listing not found or not authorized")
-    
     update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
-    if update_dict:
-        await db.listings.update_one({"id": listing_id}, {"$set": update_dict})
+    if "make" in update_dict:
+        update_dict["make_norm"] = normalize_term(update_dict["make"])
+    if "model" in update_dict:
+        update_dict["model_norm"] = normalize_term(update_dict["model"])
+    update_ops = {}
+    if "zip_code" in update_dict:
+        location = zip_location(update_dict["zip_code"])
+        if location:
+            update_dict["location"] = location
+        else:
+            update_ops["$unset"] = {"location": ""}
+    requested_images = update_dict.get("images")
+    
+    # Optimistic on `version`, like the image jobs swapping in blobs: an edit
+    # or a swap in between means checking the images again
+    while True:
+        listing = await db.listings.find_one({"id": listing_id, "user_id": user["id"]}, {"_id": 0})
+        if not listing:
+            raise HTTPException(status_code=404, detail="Listing not found or not authorized")
+        removed_images = []
+        if requested_images is not None:
+            # Images may be reordered or removed here; new ones go through add_images
+            # so the blob store's reference counts stay exact
+            current_images = listing.get("images", [])
+            update_dict["images"] = await resolve_processed_images(requested_images, current_images)
+            kept_images = Counter(update_dict["images"])
+            if kept_images - Counter(current_images):
+                raise HTTPException(status_code=400, detail="Upload new images via /listings/{id}/images")
+            removed_images = list((Counter(current_images) - kept_images).elements())
+        if update_dict:
+            update_ops["$set"] = update_dict
+        if not update_ops:
+            break
+        update_ops["$inc"] = {"version": 1}
+        result = await db.listings.update_one({"id": listing_id, "version": listing.get("version")}, update_ops)
+        if result.matched_count:
+            break
+    await release_images(removed_images)
+    
+    old_make = listing.get("make_norm") or normalize_term(listing["make"])
+    old_model = listing.get("model_norm") or normalize_term(listing["model"])
+    new_make = update_dict.get("make_norm", old_make)
+    new_model = update_dict.get("model_norm", old_model)
+    if (new_make, new_model) != (old_make, old_model):
+        invalidate_make_model_cache(old_make, new_make)
     
     updated = await db.listings.find_one({"id": listing_id}, {"_id": 0})
     updated["user_name"] = user["name"]
     return updated
 
+async def resolve_processed_images(urls: List[str], current_images: List[str]) -> List[str]:
+    """Map original URLs a client still shows to the blobs that replaced them."""
+    prefix = f"/api/images/{ORIGINALS_PREFIX}/"
+    stale = {url: Path(url).stem for url in urls if url.startswith(prefix) and url not in current_images}
+    if not stale:
+        return urls
+    processed = {
+        doc["original_hash"]: blob_url(doc["hash"])
+        async for doc in db.image_originals.find({"original_hash": {"$in": list(stale.values())}})
+    }
+    return [processed.get(stale[url], url) if url in stale else url for url in urls]
+
 @api_router.delete("/listings/{listing_id}")
 async def delete_listing(listing_id: str, authorization: str = Header(None)):
     user = await require_auth(authorization)
@@ -422,17 +2042,18 @@ async def delete_listing(listing_id: str, authorization: str = Header(None)):
         raise HTTPException(status_code=404, detail="Listing not found or not authorized")
     
     await db.listings.delete_one({"id": listing_id})
+    invalidate_make_model_cache(listing.get("make_norm") or normalize_term(listing["make"]))
     
-    # Delete images
-    listing_dir = UPLOAD_DIR / listing_id
-    if listing_dir.exists():
-        shutil.rmtree(listing_dir)
+    # Delete images no other listing shares, plus pre-blob-store image folders
+    await release_images(listing.get("images", []))
+    await storage.delete_prefix(f"{listing_id}/")
     
     return {"message": "Listing deleted"}
 
 @api_router.post("/listings/{listing_id}/images")
 async def add_images(
     listing_id: str,
+    response: Response,
     images: List[UploadFile] = File(...),
     authorization: str = Form(...)
 ):
@@ -442,41 +2063,94 @@ async def add_images(
     if not listing:
         raise HTTPException(status_code=404, detail="Listing not found or not authorized")
     
-    listing_dir = UPLOAD_DIR / listing_id
-    listing_dir.mkdir(exist_ok=True)
-    
     current_images = listing.get("images", [])
-    start_idx = len(current_images)
-    
-    new_paths = []
-    for i, img in enumerate(images):
-        content = await img.read()
-        # Compress image to JPEG under 0.5MB
-        compressed = compress_image(content)
-        filename = f"{start_idx + i}.jpg"
-        file_path = listing_dir / filename
-        with open(file_path, "wb") as f:
-            f.write(compressed)
-        new_paths.append(f"/api/images/{listing_id}/{filename}")
-    
-    await db.listings.update_one(
-        {"id": listing_id},
-        {"$push": {"images": {"$each": new_paths}}}
-    )
     
-    return {"images": current_images + new_paths}
+    # Store the originals; JPEG renditions are made in the background
+    new_paths, image_jobs, elapsed_ms = await store_uploads(images)
+    response.headers["Server-Timing"] = f"image-upload;dur={elapsed_ms:.1f}"
+    
+    try:
+        result = await db.listings.update_one(
+            {"id": listing_id, "user_id": user["id"]},
+            {"$push": {"images": {"$each": new_paths}}, "$inc": {"version": 1}}
+        )
+    except BaseException:
+        await release_images(new_paths)
+        raise
+    if not result.matched_count:
+        # Deleted while the images were uploading
+        await release_images(new_paths)
+        raise HTTPException(status_code=404, detail="Listing not found or not authorized")
+    await enqueue_image_jobs(image_jobs)
+    
+    images = current_images + new_paths
+    return {"images": images, "image_status": "processing" if pending_image_count(images) else "ready"}
+
+@api_router.get("/listings/{listing_id}/image-status")
+async def get_image_status(listing_id: str):
+    """Lightweight poll target while uploaded images are being processed."""
+    listing = await db.listings.find_one({"id": listing_id}, {"_id": 0, "images": 1, "image_errors": 1})
+    if not listing:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    images = listing.get("images", [])
+    pending = pending_image_count(images)
+    return {
+        "status": "processing" if pending else "ready",
+        "pending": pending,
+        "images": images,
+        "image_renditions": [image_rendition_urls(path) for path in images],
+        "errors": listing.get("image_errors", []),
+    }
 
 # Get unique makes and models for dropdowns
+# Entries are (etag, values); keys are "makes" and ("models", make_norm or None)
+makes_cache = TTLCache(maxsize=1024, ttl=MAKES_CACHE_TTL_SECONDS)
+
+def invalidate_make_model_cache(*make_norms: str):
+    """Drop cached dropdown lists affected by a change to the given makes."""
+    makes_cache.pop("makes")
+    makes_cache.pop(("models", None))
+    for make_norm in make_norms:
+        makes_cache.pop(("models", make_norm))
+
+def listing_adds_make_model(make_norm: str, model_norm: str) -> bool:
+    """Whether a listing with these values would change a cached dropdown list."""
+    makes = makes_cache.get("makes")
+    models = makes_cache.get(("models", make_norm))
+    if makes is None or models is None:
+        return True
+    return make_norm.title() not in makes[1] or model_norm.title() not in models[1]
+
+def list_response(etag: str, values: list, if_none_match: Optional[str]) -> Response:
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={MAKES_MAX_AGE_SECONDS}"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(values, headers=headers)
+
+def cached_list_response(key, values: list, if_none_match: Optional[str]) -> Response:
+    etag = compute_etag(values)
+    makes_cache.set(key, (etag, values))
+    return list_response(etag, values, if_none_match)
+
 @api_router.get("/makes")
-async def get_makes():
-    makes = await db.listings.distinct("make")
-    return sorted(set(m.title() for m in makes if m))
+async def get_makes(if_none_match: Optional[str] = Header(None)):
+    cached = makes_cache.get("makes")
+    if cached:
+        return list_response(*cached, if_none_match)
+    # distinct over the normalized field already collapses case variants
+    makes = await db.listings.distinct("make_norm")
+    return cached_list_response("makes", sorted(m.title() for m in makes if m), if_none_match)
 
 @api_router.get("/models")
-async def get_models(make: Optional[str] = None):
-    query = {"make": {"$regex": make, "$options": "i"}} if make else {}
-    models = await db.listings.distinct("model", query)
-    return sorted(set(m.title() for m in models if m))
+async def get_models(make: Optional[str] = None, if_none_match: Optional[str] = Header(None)):
+    make_norm = normalize_term(make) if make else None
+    key = ("models", make_norm)
+    cached = makes_cache.get(key)
+    if cached:
+        return list_response(*cached, if_none_match)
+    query = {"make_norm": make_norm} if make_norm else {}
+    models = await db.listings.distinct("model_norm", query)
+    return cached_list_response(key, sorted(m.title() for m in models if m), if_none_match)
 
 # ========== FAVORITES ==========
 class FavoriteCreate(BaseModel):
@@ -486,24 +2160,30 @@ class FavoriteCreate(BaseModel):
 async def add_favorite(data: FavoriteCreate, authorization: str = Header(None)):
     user = await require_auth(authorization)
     
-    # Check if already favorited
-    existing = await db.favorites.find_one({"user_id": user["id"], "listing_id": data.listing_id})
-    if existing:
-        return {"message": "Already in favorites", "id": existing.get("id")}
-    
+    # Upsert so that only the request that actually creates the favorite
+    # bumps the listing's denormalized favorite_count
     fav_id = str(uuid.uuid4())
-    await db.favorites.insert_one({
-        "id": fav_id,
-        "user_id": user["id"],
-        "listing_id": data.listing_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    result = await db.favorites.update_one(
+        {"user_id": user["id"], "listing_id": data.listing_id},
+        {"$setOnInsert": {
+            "id": fav_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+    if result.upserted_id is None:
+        existing = await db.favorites.find_one({"user_id": user["id"], "listing_id": data.listing_id}, {"_id": 0, "id": 1})
+        return {"message": "Already in favorites", "id": existing.get("id") if existing else None}
+    
+    await db.listings.update_one({"id": data.listing_id}, {"$inc": {"favorite_count": 1, "version": 1}})
     return {"message": "Added to favorites", "id": fav_id}
 
 @api_router.delete("/favorites/{listing_id}")
 async def remove_favorite(listing_id: str, authorization: str = Header(None)):
     user = await require_auth(authorization)
-    await db.favorites.delete_one({"user_id": user["id"], "listing_id": listing_id})
+    result = await db.favorites.delete_one({"user_id": user["id"], "listing_id": listing_id})
+    if result.deleted_count:
+        await db.listings.update_one({"id": listing_id}, {"$inc": {"favorite_count": -1, "version": 1}})
     return {"message": "Removed from favorites"}
 
 @api_router.get("/favorites")
@@ -516,11 +2196,10 @@ async def get_favorites(authorization: str = Header(None)):
     for fav in favorites:
         listing = await db.listings.find_one({"id": fav["listing_id"]}, {"_id": 0})
         if listing:
-            listing_user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "avatar": 1})
+            listing_user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "avatar": 1, "avatar_renditions": 1})
             listing["user_name"] = listing_user["name"] if listing_user else "Unknown"
-            listing["user_avatar"] = listing_user.get("avatar") if listing_user else None
+            listing["user_avatar"] = avatar_url(listing_user, "card")
             listing["favorite_id"] = fav["id"]
-            listing["favorite_count"] = await db.favorites.count_documents({"listing_id": listing["id"]})
             result.append(listing)
     return result
 
@@ -572,8 +2251,17 @@ class MessageResponse(BaseModel):
     listing_id: str
 
 @api_router.get("/messages/conversation", response_model=List[dict])
-async def get_conversation(listing_id: str, other_user_id: str, authorization: str = Header(None)):
-    """Return full conversation for a listing between current user and other user."""
+async def get_conversation(
+    response: Response,
+    listing_id: str,
+    other_user_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    authorization: str = Header(None)
+):
+    """Messages between the current user and another user about a listing,
+    newest first. Pass the `X-Next-Cursor` response header back as `before`
+    for older messages."""
     user = await require_auth(authorization)
 
     query = {
@@ -583,20 +2271,257 @@ async def get_conversation(listing_id: str, other_user_id: str, authorization: s
             {"sender_id": other_user_id, "receiver_id": user["id"]},
         ],
     }
-
-    messages = await db.messages.find(query, {"_id": 0}).sort("created_at", 1).to_list(200)
-
-    # enrich with names and basic listing info
+    if before:
+        created_at, message_id = decode_keyset_cursor(before)
+        query["$and"] = [{"$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": message_id}},
+        ]}]
+
+    messages = await db.messages.find(query, {"_id": 0}).sort(
+        [("created_at", DESCENDING), ("id", DESCENDING)]
+    ).limit(limit).to_list(limit)
+
+    # Names and listing title are the same for every message in the page
+    participants = await db.users.find(
+        {"id": {"$in": [user["id"], other_user_id]}}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    names = {u["id"]: u["name"] for u in participants}
     listing = await db.listings.find_one({"id": listing_id}, {"_id": 0, "make": 1, "model": 1, "year": 1})
+    listing_title = f"{listing['year']} {listing['make']} {listing['model']}" if listing else None
     for msg in messages:
-        sender = await db.users.find_one({"id": msg["sender_id"]}, {"_id": 0, "name": 1})
-        receiver = await db.users.find_one({"id": msg["receiver_id"]}, {"_id": 0, "name": 1})
-        msg["sender_name"] = sender["name"] if sender else "Unknown"
-        msg["receiver_name"] = receiver["name"] if receiver else "Unknown"
-        msg["listing_title"] = f"{listing['year']} {listing['make']} {listing['model']}" if listing else None
+        msg["sender_name"] = names.get(msg["sender_id"], "Unknown")
+        msg["receiver_name"] = names.get(msg["receiver_id"], "Unknown")
+        msg["listing_title"] = listing_title
 
+    if len(messages) == limit:
+        response.headers["X-Next-Cursor"] = encode_keyset_cursor(messages[-1]["created_at"], messages[-1]["id"])
     return messages
 
+class EventBroker(ABC):
+    """Routes per-user events to the event streams open on this worker."""
+    
+    def __init__(self):
+        self._subscribers = {}
+    
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+    
+    def deliver(self, user_id: str, event: dict) -> None:
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                # The client is not keeping up: drop its backlog and have it refetch
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+            else:
+                queue.put_nowait(event)
+    
+    def resync_all(self) -> None:
+        """Tell every local stream that events may have been missed."""
+        for user_id in list(self._subscribers):
+            for queue in self._subscribers[user_id]:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+    
+    def stream_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+    
+    @abstractmethod
+    async def publish(self, user_id: str, event: dict) -> None:
+        """Deliver an event to the user's streams on every worker."""
+    
+    async def start(self) -> None:
+        pass
+    
+    async def stop(self) -> None:
+        pass
+
+class LocalBroker(EventBroker):
+    """Single-worker broker: published events go straight to local streams."""
+    
+    async def publish(self, user_id: str, event: dict) -> None:
+        self.deliver(user_id, event)
+
+class MongoBroker(EventBroker):
+    """Multi-worker broker: events are inserted into a collection and every
+    worker delivers them to its own streams from a change stream."""
+    
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+        self._task = None
+    
+    async def publish(self, user_id: str, event: dict) -> None:
+        await self.collection.insert_one({"user_id": user_id, "event": event, "at": datetime.now(timezone.utc)})
+    
+    async def start(self) -> None:
+        # Change streams need a replica set (or a sharded cluster); without one
+        # _listen() would only log errors forever, so refuse to start
+        hello = await self.collection.database.command("hello")
+        if "setName" not in hello and hello.get("msg") != "isdbgrid":
+            raise RuntimeError(
+                "EVENT_BROKER=mongo needs MongoDB running as a replica set; "
+                "use EVENT_BROKER=local with a single worker"
+            )
+        self._task = asyncio.create_task(self._listen())
+    
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+    
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                    async for change in stream:
+                        doc = change["fullDocument"]
+                        self.deliver(doc["user_id"], doc["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event change stream interrupted: {e}")
+                # Anything published while reconnecting is lost, so clients refetch
+                self.resync_all()
+                await asyncio.sleep(1)
+
+def create_broker() -> EventBroker:
+    if EVENT_BROKER == "local":
+        return LocalBroker()
+    if EVENT_BROKER == "mongo":
+        return MongoBroker(db.events)
+    raise RuntimeError(f"Unknown EVENT_BROKER: {EVENT_BROKER}")
+
+broker = create_broker()
+
+async def publish_events(user_ids, event: dict) -> None:
+    """Push an event to users' open streams. Delivery is best effort: the
+    write that triggered it has already succeeded and clients resync on reconnect."""
+    for user_id in user_ids:
+        try:
+            await broker.publish(user_id, event)
+        except Exception as e:
+            logger.error(f"Could not publish {event['type']} event: {e}")
+
+async def unread_message_count(user_id: str) -> int:
+    return await db.messages.count_documents({"receiver_id": user_id, "read": False})
+
+async def publish_unread_count(user_id: str) -> None:
+    await publish_events([user_id], {"type": "unread-count", "count": await unread_message_count(user_id)})
+
+def sse_event(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+def event_ticket_key(ticket: str) -> str:
+    # Only a hash is stored, so the collection can't be used to open streams
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+@api_router.post("/events/ticket")
+async def create_event_ticket(authorization: str = Header(None)):
+    """Single-use ticket for opening GET /api/events?ticket=..., so the
+    long-lived JWT never ends up in URLs (and so in logs and history)."""
+    user = await require_auth(authorization)
+    ticket = base64.urlsafe_b64encode(os.urandom(24)).decode()
+    await db.event_tickets.insert_one({
+        "_id": event_ticket_key(ticket),
+        "user_id": user["id"],
+        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=EVENT_TICKET_TTL_SECONDS),
+    })
+    return {"ticket": ticket, "expires_in": EVENT_TICKET_TTL_SECONDS}
+
+async def redeem_event_ticket(ticket: str) -> Optional[str]:
+    """User id of an unexpired ticket, which can't be used again afterwards."""
+    doc = await db.event_tickets.find_one_and_delete(
+        {"_id": event_ticket_key(ticket), "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    )
+    return doc and doc["user_id"]
+
+@api_router.get("/events")
+async def stream_events(request: Request, ticket: Optional[str] = None, authorization: str = Header(None)):
+    """Server-Sent Events stream of the current user's message events:
+    `message`, `read`, `unread-count` and `resync` (refetch everything).
+    EventSource cannot send headers, so browsers pass a ticket from
+    POST /api/events/ticket as ?ticket= and fetch a new one to reconnect."""
+    if ticket and not authorization:
+        user_id = await redeem_event_ticket(ticket)
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Invalid or expired ticket")
+        user = {"id": user_id}
+    else:
+        user = await require_auth(authorization)
+    queue = broker.subscribe(user["id"])
+    
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield sse_event({"type": "unread-count", "count": await unread_message_count(user["id"])})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(event)
+        finally:
+            broker.unsubscribe(user["id"], queue)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop reverse proxies from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
+
+# Each conversation (listing + pair of users) has one `threads` document with
+# its last message and per-participant unread counts, kept up to date by the
+# message routes, so the inbox is a single indexed query.
+def thread_id(listing_id: str, user_a: str, user_b: str) -> str:
+    low, high = sorted((user_a, user_b))
+    return f"{listing_id}::{low}::{high}"
+
+async def record_thread_message(msg: dict) -> None:
+    """Count a new message as unread for its receiver and make it the thread's last message."""
+    participants = sorted((msg["sender_id"], msg["receiver_id"]))
+    tid = thread_id(msg["listing_id"], *participants)
+    await db.threads.update_one(
+        {"id": tid},
+        {
+            "$setOnInsert": {"listing_id": msg["listing_id"], "participants": participants, "last_created_at": ""},
+            "$inc": {f"unread.{msg['receiver_id']}": 1},
+        },
+        upsert=True,
+    )
+    # Only move last_* forward, so concurrent sends settle on the newest message
+    await db.threads.update_one(
+        {"id": tid, "last_created_at": {"$lt": msg["created_at"]}},
+        {"$set": {
+            "last_message": msg["message"],
+            "last_message_id": msg["id"],
+            "last_sender_id": msg["sender_id"],
+            "last_created_at": msg["created_at"],
+        }},
+    )
+
+async def record_thread_reads(listing_id: str, reader_id: str, sender_id: str, count: int) -> None:
+    if count:
+        await db.threads.update_one(
+            {"id": thread_id(listing_id, reader_id, sender_id)},
+            {"$inc": {f"unread.{reader_id}": -count}},
+        )
+
 @api_router.post("/messages")
 async def send_message(data: MessageCreate, authorization: str = Header(None)):
     user = await require_auth(authorization)
@@ -607,7 +2532,7 @@ async def send_message(data: MessageCreate, authorization: str = Header(None)):
         raise HTTPException(status_code=404, detail="Listing not found")
     
     msg_id = str(uuid.uuid4())
-    await db.messages.insert_one({
+    msg_doc = {
         "id": msg_id,
         "listing_id": data.listing_id,
         "sender_id": user["id"],
@@ -615,60 +2540,71 @@ async def send_message(data: MessageCreate, authorization: str = Header(None)):
         "message": data.message,
         "read": False,
         "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    }
+    await db.messages.insert_one(msg_doc)
+    await record_thread_message(msg_doc)
+    
+    msg_doc.pop("_id", None)
+    await publish_events({user["id"], data.receiver_id}, {"type": "message", "message": msg_doc})
+    await publish_unread_count(data.receiver_id)
     return {"message": "Message sent", "id": msg_id}
 
 @api_router.get("/messages/threads")
-async def get_threads(authorization: str = Header(None)):
+async def get_threads(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    authorization: str = Header(None)
+):
     user = await require_auth(authorization)
 
-    messages = await db.messages.find(
-        {"$or": [
-            {"sender_id": user["id"]},
-            {"receiver_id": user["id"]},
-        ]},
-        {"_id": 0}
-    ).sort("created_at", -1).to_list(200)
-
-    threads = {}
+    query = {"participants": user["id"]}
+    if cursor:
+        last_created_at, tid = decode_keyset_cursor(cursor)
+        query["$or"] = [
+            {"last_created_at": {"$lt": last_created_at}},
+            {"last_created_at": last_created_at, "id": {"$lt": tid}},
+        ]
+    threads = await db.threads.find(query, {"_id": 0}).sort(
+        [("last_created_at", DESCENDING), ("id", DESCENDING)]
+    ).limit(limit).to_list(limit)
+
+    # One lookup each for the other participants and listings on this page
+    other_ids = {next((p for p in t["participants"] if p != user["id"]), user["id"]) for t in threads}
+    listing_ids = {t["listing_id"] for t in threads}
+    users = {
+        u["id"]: u for u in await db.users.find(
+            {"id": {"$in": list(other_ids)}},
+            {"_id": 0, "id": 1, "name": 1, "nickname": 1, "avatar": 1, "avatar_renditions": 1},
+        ).to_list(None)
+    }
+    listings = {
+        l["id"]: l for l in await db.listings.find(
+            {"id": {"$in": list(listing_ids)}},
+            {"_id": 0, "id": 1, "make": 1, "model": 1, "year": 1, "images": 1},
+        ).to_list(None)
+    }
 
-    for msg in messages:
-        other_id = msg["receiver_id"] if msg["sender_id"] == user["id"] else msg["sender_id"]
-        key = f"{msg['listing_id']}::{other_id}"
-
-        thread = threads.get(key)
-        if not thread:
-            # fetch user and listing once per thread
-            other_user = await db.users.find_one({"id": other_id}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1})
-            listing = await db.listings.find_one({"id": msg["listing_id"]}, {"_id": 0, "make": 1, "model": 1, "year": 1, "images": 1})
-            listing_title = f"{listing['year']} {listing['make']} {listing['model']}" if listing else "Deleted listing"
-            listing_image = listing["images"][0] if listing and listing.get("images") else None
-
-            thread = {
-                "id": key,
-                "listing_id": msg["listing_id"],
-                "other_user_id": other_id,
-                "other_user_name": (other_user.get("nickname") or other_user["name"]) if other_user else "Unknown",
-                "other_user_avatar": other_user.get("avatar") if other_user else None,
-                "listing_title": listing_title,
-                "listing_image": listing_image,
-                "last_message": msg["message"],
-                "last_created_at": msg["created_at"],
-                "unread_count": 0,
-            }
-            threads[key] = thread
-
-        # update last message if this msg is newer
-        if msg["created_at"] > thread["last_created_at"]:
-            thread["last_message"] = msg["message"]
-            thread["last_created_at"] = msg["created_at"]
-
-        # unread count (only messages to current user and not read)
-        if msg["receiver_id"] == user["id"] and not msg.get("read", False):
-            thread["unread_count"] += 1
-
-    # sort threads by last_created_at desc
-    result = sorted(threads.values(), key=lambda t: t["last_created_at"], reverse=True)
+    result = []
+    for thread in threads:
+        other_id = next((p for p in thread["participants"] if p != user["id"]), user["id"])
+        other_user = users.get(other_id)
+        listing = listings.get(thread["listing_id"])
+        result.append({
+            "id": f"{thread['listing_id']}::{other_id}",
+            "listing_id": thread["listing_id"],
+            "other_user_id": other_id,
+            "other_user_name": (other_user.get("nickname") or other_user["name"]) if other_user else "Unknown",
+            "other_user_avatar": avatar_url(other_user, "thumb"),
+            "listing_title": f"{listing['year']} {listing['make']} {listing['model']}" if listing else "Deleted listing",
+            "listing_image": listing["images"][0] if listing and listing.get("images") else None,
+            "last_message": thread.get("last_message"),
+            "last_created_at": thread["last_created_at"],
+            "unread_count": max(0, (thread.get("unread") or {}).get(user["id"], 0)),
+        })
+
+    if len(threads) == limit:
+        response.headers["X-Next-Cursor"] = encode_keyset_cursor(threads[-1]["last_created_at"], threads[-1]["id"])
     return result
 
 
@@ -703,13 +2639,25 @@ async def get_sent_messages(authorization: str = Header(None)):
 @api_router.get("/messages/unread-count")
 async def get_unread_count(authorization: str = Header(None)):
     user = await require_auth(authorization)
-    count = await db.messages.count_documents({"receiver_id": user["id"], "read": False})
-    return {"count": count}
+    return {"count": await unread_message_count(user["id"])}
 
 @api_router.put("/messages/{message_id}/read")
 async def mark_as_read(message_id: str, authorization: str = Header(None)):
     user = await require_auth(authorization)
-    await db.messages.update_one({"id": message_id, "receiver_id": user["id"]}, {"$set": {"read": True}})
+    msg = await db.messages.find_one_and_update(
+        {"id": message_id, "receiver_id": user["id"], "read": False},
+        {"$set": {"read": True}},
+        projection={"_id": 0, "listing_id": 1, "sender_id": 1},
+    )
+    if msg:
+        await record_thread_reads(msg["listing_id"], user["id"], msg["sender_id"], 1)
+        await publish_events([msg["sender_id"]], {
+            "type": "read",
+            "listing_id": msg["listing_id"],
+            "reader_id": user["id"],
+            "message_id": message_id,
+        })
+        await publish_unread_count(user["id"])
     return {"message": "Marked as read"}
 
 class ReadConversationRequest(BaseModel):
@@ -720,12 +2668,23 @@ class ReadConversationRequest(BaseModel):
 async def mark_conversation_read(data: ReadConversationRequest, authorization: str = Header(None)):
     user = await require_auth(authorization)
     # Mark all messages in this thread where current user is the receiver as read
-    await db.messages.update_many({
+    result = await db.messages.update_many({
         "listing_id": data.listing_id,
         "receiver_id": user["id"],
         "sender_id": data.other_user_id,
         "read": False
     }, {"$set": {"read": True}})
+    # Decrement by what was actually flipped (rather than zeroing) so a
+    # message sent concurrently stays counted
+    await record_thread_reads(data.listing_id, user["id"], data.other_user_id, result.modified_count)
+    if result.modified_count:
+        # Read receipt for the whole conversation up to now
+        await publish_events([data.other_user_id], {
+            "type": "read",
+            "listing_id": data.listing_id,
+            "reader_id": user["id"],
+        })
+        await publish_unread_count(user["id"])
     return {"message": "Conversation marked as read"}
 
 @api_router.get("/")
@@ -759,30 +2718,50 @@ async def update_profile(data: ProfileUpdate, authorization: str = Header(None))
     update_dict = {k: v for k, v in data.model_dump().items() if v is not None}
     if update_dict:
         await db.users.update_one({"id": user["id"]}, {"$set": update_dict})
+        await invalidate_user(user["id"])
     
     updated = await db.users.find_one({"id": user["id"]}, {"_id": 0, "password": 0})
     return updated
 
+async def remove_avatar_files(url: str) -> None:
+    """Delete the stored files (all renditions) of a previous avatar URL."""
+    prefix = "/api/images/avatars/"
+    filename = url.partition("?")[0][len(prefix):] if url.startswith(prefix) else ""
+    stem = filename.rpartition(".")[0]
+    if not stem or not IMAGE_PATH_SEGMENT.match(filename):
+        return
+    await storage.delete_prefix(f"avatars/{stem}.")
+    await storage.delete_prefix(f"avatars/{stem}_")
+
 @api_router.post("/profile/avatar")
 async def upload_avatar(avatar: UploadFile = File(...), authorization: str = Form(...)):
     user = await require_auth(authorization)
     
-    # Save avatar
-    avatar_dir = UPLOAD_DIR / "avatars"
-    avatar_dir.mkdir(exist_ok=True)
-    
-    ext = avatar.filename.split('.')[-1] if '.' in avatar.filename else 'jpg'
-    filename = f"{user['id']}.{ext}"
-    file_path = avatar_dir / filename
-    
-    with open(file_path, "wb") as f:
-        content = await avatar.read()
-        f.write(content)
+    # Decode, crop and re-encode off the event loop; the client's file name
+    # and content type are never trusted
+    path, original_hash = await spool_upload(avatar, AVATAR_MAX_UPLOAD_BYTES)
+    try:
+        renditions = await run_image_task(render_avatar, str(path))
+    finally:
+        path.unlink(missing_ok=True)
     
-    avatar_url = f"/api/images/avatars/{filename}"
-    await db.users.update_one({"id": user["id"]}, {"$set": {"avatar": avatar_url}})
+    filename = f"{user['id']}-{original_hash[:16]}.jpg"
+    keys = {size: f"avatars/{rendition_filename(filename, size)}" for size in renditions}
+    await asyncio.gather(*(storage.put(keys[size], data, "image/jpeg") for size, data in renditions.items()))
+    avatar_renditions = {size: f"/api/images/{key}" for size, key in keys.items()}
+    # The avatar being replaced comes from the write itself: the cached user
+    # may be stale, e.g. after a concurrent upload
+    previous = await db.users.find_one_and_update(
+        {"id": user["id"]},
+        {"$set": {"avatar": avatar_renditions["full"], "avatar_renditions": avatar_renditions}},
+        projection={"avatar": 1},
+        return_document=ReturnDocument.BEFORE,
+    )
+    await invalidate_user(user["id"])
+    if previous and previous.get("avatar") and previous["avatar"] != avatar_renditions["full"]:
+        await remove_avatar_files(previous["avatar"])
     
-    return {"avatar": avatar_url}
+    return {"avatar": avatar_renditions["full"], "avatar_renditions": avatar_renditions}
 
 @api_router.get("/users/{user_id}/public")
 async def get_public_profile(user_id: str):
@@ -794,7 +2773,7 @@ async def get_public_profile(user_id: str):
     listings = await db.listings.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(50)
     for listing in listings:
         listing["user_name"] = user.get("nickname") or user.get("name", "Unknown")
-        listing["user_avatar"] = user.get("avatar")
+        listing["user_avatar"] = avatar_url(user, "card")
     
     # Get favorites if allowed
     favorites = []
@@ -803,9 +2782,9 @@ async def get_public_profile(user_id: str):
         for fav in fav_docs:
             listing = await db.listings.find_one({"id": fav["listing_id"]}, {"_id": 0})
             if listing:
-                listing_user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1})
+                listing_user = await db.users.find_one({"id": listing["user_id"]}, {"_id": 0, "name": 1, "nickname": 1, "avatar": 1, "avatar_renditions": 1})
                 listing["user_name"] = listing_user.get("nickname") or listing_user.get("name", "Unknown") if listing_user else "Unknown"
-                listing["user_avatar"] = listing_user.get("avatar") if listing_user else None
+                listing["user_avatar"] = avatar_url(listing_user, "card")
                 favorites.append(listing)
     
     # Get saved searches if allowed
@@ -820,13 +2799,31 @@ async def get_public_profile(user_id: str):
         "saved_searches": saved_searches
     }
 
-# Serve avatar images
-@api_router.get("/images/avatars/{filename}")
-async def get_avatar_image(filename: str):
-    file_path = UPLOAD_DIR / "avatars" / filename
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Avatar not found")
-    return FileResponse(file_path, media_type="image/jpeg")
+def require_metrics_access(request: Request, authorization: Optional[str] = Header(None)) -> None:
+    if METRICS_TOKEN:
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+            return
+    elif request.client and "x-forwarded-for" not in request.headers:
+        try:
+            if ipaddress.ip_address(request.client.host).is_private:
+                return
+        except ValueError:
+            pass
+    raise HTTPException(status_code=403, detail="Metrics are not available to this client")
+
+@api_router.get("/metrics", dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    """Per-worker counters for capacity monitoring."""
+    return {
+        "auth": {
+            **auth_gate.stats(),
+            "hash_workers": PASSWORD_HASH_WORKERS,
+            "hash_latency_ms": latency_summary(hash_latencies_ms),
+        },
+        "user_cache": {"users": len(user_cache), "tokens": len(token_cache)},
+        "event_streams": broker.stream_count(),
+    }
 
 # ========== TEST SEED (for CI/CD) ==========
 class TestSeedUser(BaseModel):
@@ -838,13 +2835,16 @@ class TestSeedUser(BaseModel):
 async def seed_test_user(data: TestSeedUser):
     """Seed or reset a test user. Used by CI/CD test setup to ensure test user exists with correct credentials."""
     # Delete existing user with this email (if any)
+    existing = await db.users.find({"email": data.email}, {"_id": 0, "id": 1}).to_list(None)
     await db.users.delete_many({"email": data.email})
+    for doc in existing:
+        await invalidate_user(doc["id"])
     
     user_id = str(uuid.uuid4())
     user_doc = {
         "id": user_id,
         "email": data.email,
-        "password": hash_password(data.password),
+        "password": await run_bcrypt(hash_password, data.password),
         "name": data.name,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -854,17 +2854,557 @@ async def seed_test_user(data: TestSeedUser):
 
 app.include_router(api_router)
 
+class RequestSizeLimit:
+    """Reject request bodies over a limit before they are received.
+    
+    Requests declaring a larger Content-Length get 413 immediately; chunked
+    bodies are cut off with 413 as soon as they pass the limit."""
+    
+    def __init__(self, app, max_bytes: int, path_limits: dict):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self.path_limits.get(scope["path"], self.max_bytes)
+        detail = f"Request body exceeds the {limit // (1024 * 1024)}MB limit"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+        
+        received = 0
+        
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, limited_receive, send)
+
+app.add_middleware(
+    RequestSizeLimit,
+    max_bytes=MAX_REQUEST_BYTES,
+    path_limits={"/api/profile/avatar": AVATAR_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES},
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing", "Retry-After"],
 )
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# ========== INDEXES ==========
+# Every index the routes rely on, declared per collection as (keys, options).
+
+INDEXES = {
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "listings": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("make_norm", ASCENDING), ("model_norm", ASCENDING)], {}),
+        ([("model_norm", ASCENDING)], {}),
+        ([("location", "2dsphere")], {}),
+        # Image jobs find the listings showing an original
+        ([("images", ASCENDING)], {}),
+        # Only one text index is allowed per collection
+        ([("make", "text"), ("model", "text"), ("city", "text"), ("description", "text")],
+         {"name": "listing_text", "weights": {"make": 10, "model": 10, "city": 3, "description": 1},
+          "default_language": "english"}),
+    ],
+    "favorites": [
+        ([("user_id", ASCENDING), ("listing_id", ASCENDING)], {"unique": True}),
+        ([("listing_id", ASCENDING)], {}),
+    ],
+    "saved_searches": [
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("id", ASCENDING)], {}),
+    ],
+    "image_blobs": [
+        ([("hash", ASCENDING)], {"unique": True}),
+    ],
+    "image_jobs": [
+        ([("original_hash", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING), ("created_at", ASCENDING)], {}),
+    ],
+    "events": [
+        ([("at", ASCENDING)], {"expireAfterSeconds": EVENT_RETENTION_SECONDS}),
+    ],
+    "cache_invalidations": [
+        ([("at", ASCENDING)], {"expireAfterSeconds": CACHE_INVALIDATION_RETENTION_SECONDS}),
+    ],
+    "event_tickets": [
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "image_originals": [
+        ([("original_hash", ASCENDING)], {"unique": True}),
+        ([("hash", ASCENDING)], {}),
+    ],
+    "threads": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("participants", ASCENDING), ("last_created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "messages": [
+        ([("id", ASCENDING)], {}),
+        ([("receiver_id", ASCENDING), ("read", ASCENDING)], {}),
+        ([("receiver_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("sender_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        # Each branch of the conversation $or (and read-conversation's filter)
+        # is an equality prefix of this index, already in page order
+        ([("listing_id", ASCENDING), ("receiver_id", ASCENDING), ("sender_id", ASCENDING),
+          ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+}
+
+# Indexes superseded by one in INDEXES, dropped once their replacement exists
+OBSOLETE_INDEXES = {
+    "messages": ["listing_id_1_receiver_id_1_sender_id_1"],
+}
+
+# Representative query shapes per route: (route, collection, filter, sort)
+ROUTE_QUERY_SHAPES = [
+    ("GET /auth/me", "users", {"id": "x"}, None),
+    ("POST /auth/login", "users", {"email": "x@example.com"}, None),
+    ("GET /listings", "listings", {}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings?cursor", "listings",
+     {"$or": [{"created_at": {"$lt": "x"}}, {"created_at": "x", "id": {"$lt": "x"}}]},
+     [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /listings?make&model", "listings",
+     {"make_norm": {"$regex": "^x"}, "model_norm": {"$regex": "^x"}}, None),
+    ("GET /models?make", "listings", {"make_norm": "x"}, None),
+    ("GET /listings?q", "listings", {"$text": {"$search": "x"}}, None),
+    ("GET /listings?zip_code&distance", "listings",
+     {"location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [0, 0]}, "$maxDistance": 1000}}},
+     None),
+    ("GET /listings/{id}", "listings", {"id": "x"}, None),
+    ("GET /my-listings", "listings", {"user_id": "x"}, [("created_at", DESCENDING)]),
+    ("POST /favorites", "favorites", {"user_id": "x", "listing_id": "x"}, None),
+    ("GET /favorites", "favorites", {"user_id": "x"}, None),
+    ("POST /listings (images)", "image_originals", {"original_hash": {"$in": ["x"]}}, None),
+    ("image job worker", "image_jobs", {"status": "pending"}, [("created_at", ASCENDING)]),
+    ("image job worker", "listings", {"images": "x"}, None),
+    ("DELETE /listings/{id}", "image_blobs", {"hash": "x", "refcount": {"$lte": 0}, "deleting_at": None}, None),
+    ("GET /saved-searches", "saved_searches", {"user_id": "x"}, [("created_at", DESCENDING)]),
+    ("user cache sync", "cache_invalidations", {"at": {"$gt": "x"}}, None),
+    ("GET /messages/threads", "threads", {"participants": "x"}, [("last_created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /messages/inbox", "messages", {"receiver_id": "x"}, [("created_at", DESCENDING)]),
+    ("GET /messages/sent", "messages", {"sender_id": "x"}, [("created_at", DESCENDING)]),
+    ("GET /messages/conversation", "messages",
+     {"listing_id": "x", "$or": [{"sender_id": "x", "receiver_id": "y"}, {"sender_id": "y", "receiver_id": "x"}]},
+     [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("GET /messages/unread-count", "messages", {"receiver_id": "x", "read": False}, None),
+    ("POST /messages/read-conversation", "messages",
+     {"listing_id": "x", "receiver_id": "x", "sender_id": "x", "read": False}, None),
+]
+
+async def ensure_indexes():
+    """Create all declared indexes, logging (not raising) any that fail."""
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, background=True, **options)
+            except Exception as e:
+                logger.error(f"Failed to create index {keys} on {collection}: {e}")
+    for collection, names in OBSOLETE_INDEXES.items():
+        for name in names:
+            try:
+                await db[collection].drop_index(name)
+                logger.info(f"Dropped obsolete index {name} on {collection}")
+            except Exception as e:
+                # 27 is IndexNotFound: dropped before, or never created here
+                if getattr(e, "code", None) != 27:
+                    logger.error(f"Failed to drop index {name} on {collection}: {e}")
+    logger.info("Index bootstrap finished")
+
+def _plan_stages(plan) -> list:
+    """Flatten the stage names of an explain() query plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("inputStage", "queryPlan"):
+            stages.extend(_plan_stages(plan.get(key)))
+        for child in plan.get("inputStages", []):
+            stages.extend(_plan_stages(child))
+    return stages
+
+async def index_coverage_report() -> list:
+    """Explain each route's query shape and flag those that still COLLSCAN."""
+    report = []
+    for route, collection, query_filter, sort in ROUTE_QUERY_SHAPES:
+        command = {"find": collection, "filter": query_filter}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = await db.command("explain", command, verbosity="queryPlanner")
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        report.append({
+            "route": route,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+@app.on_event("startup")
+async def create_indexes_in_background():
+    # Fire and forget: index builds must not delay the app accepting requests
+    app.state.index_task = asyncio.create_task(ensure_indexes())
+
+@app.on_event("startup")
+async def load_reference_data():
+    # Parse the ZIP centroid table once, off the event loop
+    await asyncio.to_thread(load_zip_centroids)
+
+@app.on_event("startup")
+async def start_image_job_workers():
+    # Resume work interrupted by a crash or redeploy, then start the workers
+    try:
+        requeued = await requeue_orphaned_originals()
+        if requeued:
+            logger.info(f"Requeued {requeued} unprocessed images")
+    except Exception as e:
+        logger.error(f"Could not requeue unprocessed images: {e}")
+    _image_job_tasks.extend(asyncio.create_task(image_job_worker()) for _ in range(IMAGE_JOB_WORKERS))
+
+@app.on_event("startup")
+async def start_event_broker():
+    await broker.start()
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    await broker.stop()
+
+@app.on_event("startup")
+async def start_user_cache_sync():
+    app.state.user_cache_sync_task = asyncio.create_task(sync_user_cache())
+
+@app.on_event("shutdown")
+async def stop_user_cache_sync():
+    task = getattr(app.state, "user_cache_sync_task", None)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+@app.on_event("shutdown")
+async def stop_image_job_workers():
+    for task in _image_job_tasks:
+        task.cancel()
+    await asyncio.gather(*_image_job_tasks, return_exceptions=True)
+    _image_job_tasks.clear()
+
+@app.on_event("shutdown")
+async def stop_variant_transcodes():
+    tasks = list(_variant_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+@app.on_event("shutdown")
+async def shutdown_password_executor():
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False, cancel_futures=True)
+        _password_executor = None
+
+@app.on_event("shutdown")
+async def shutdown_image_executor():
+    global _image_executor
+    if _image_executor is not None:
+        _image_executor.shutdown(wait=False, cancel_futures=True)
+        _image_executor = None
+
+# ========== MAINTENANCE COMMANDS ==========
+# Run from the backend directory, e.g. `python server.py reconcile-favorites`
+cli = typer.Typer(help="NextRides maintenance commands")
+
+async def _reconcile_favorite_batch(listings: list) -> int:
+    ids = [listing["id"] for listing in listings]
+    rows = await db.favorites.aggregate([
+        {"$match": {"listing_id": {"$in": ids}}},
+        {"$group": {"_id": "$listing_id", "n": {"$sum": 1}}},
+    ]).to_list(None)
+    counts = {row["_id"]: row["n"] for row in rows}
+    ops = [
+        UpdateOne(
+            {"id": listing["id"], "favorite_count": {"$ne": counts.get(listing["id"], 0)}},
+            {"$set": {"favorite_count": counts.get(listing["id"], 0)}, "$inc": {"version": 1}}
+        )
+        for listing in listings
+        if listing.get("favorite_count") != counts.get(listing["id"], 0)
+    ]
+    if not ops:
+        return 0
+    result = await db.listings.bulk_write(ops, ordered=False)
+    return result.modified_count
+
+async def reconcile_favorite_counts(batch_size: int = 1000) -> dict:
+    """Rebuild every listing's favorite_count from the favorites collection.
+    
+    Walks the listings in batches and counts favorites per batch, so memory
+    and query size stay bounded however many listings have favorites."""
+    checked = updated = 0
+    batch = []
+    async for listing in db.listings.find({}, {"_id": 0, "id": 1, "favorite_count": 1}).sort("id", ASCENDING):
+        batch.append(listing)
+        if len(batch) >= batch_size:
+            updated += await _reconcile_favorite_batch(batch)
+            checked += len(batch)
+            batch = []
+    if batch:
+        updated += await _reconcile_favorite_batch(batch)
+        checked += len(batch)
+    return {"listings": checked, "updated": updated}
+
+@cli.command("reconcile-favorites")
+def reconcile_favorites_command(batch_size: int = 1000):
+    """Recount favorite_count on all listings in bulk."""
+    stats = asyncio.run(reconcile_favorite_counts(batch_size))
+    typer.echo(f"Reconciled favorite counts: {stats}")
+
+async def _backfill_normalized_batch(listings: list) -> int:
+    ops = [
+        UpdateOne(
+            # Matching make/model skips listings edited since they were read
+            {"id": listing["id"], "make": listing["make"], "model": listing["model"]},
+            {"$set": {"make_norm": normalize_term(listing["make"]), "model_norm": normalize_term(listing["model"])}},
+        )
+        for listing in listings
+        if listing.get("make_norm") != normalize_term(listing["make"])
+        or listing.get("model_norm") != normalize_term(listing["model"])
+    ]
+    if not ops:
+        return 0
+    result = await db.listings.bulk_write(ops, ordered=False)
+    return result.modified_count
+
+async def backfill_normalized_fields(batch_size: int = 1000) -> int:
+    """Populate make_norm/model_norm on listings written before they existed.
+    
+    Normalizes in Python with normalize_term (the database's $toLower only
+    folds ASCII) and also repairs values that no longer match it."""
+    updated = 0
+    batch = []
+    projection = {"_id": 0, "id": 1, "make": 1, "model": 1, "make_norm": 1, "model_norm": 1}
+    async for listing in db.listings.find({}, projection).sort("id", ASCENDING):
+        batch.append(listing)
+        if len(batch) >= batch_size:
+            updated += await _backfill_normalized_batch(batch)
+            batch = []
+    if batch:
+        updated += await _backfill_normalized_batch(batch)
+    if updated:
+        invalidate_make_model_cache()
+    return updated
+
+async def backfill_locations() -> int:
+    """Attach GeoJSON locations to listings that don't have one yet."""
+    zip_codes = await db.listings.distinct("zip_code", {"location": {"$exists": False}})
+    ops = []
+    for zip_code in zip_codes:
+        location = zip_location(zip_code)
+        if location:
+            ops.append(UpdateMany({"zip_code": zip_code, "location": {"$exists": False}}, {"$set": {"location": location}}))
+    if not ops:
+        return 0
+    result = await db.listings.bulk_write(ops, ordered=False)
+    return result.modified_count
+
+@cli.command("backfill-locations")
+def backfill_locations_command():
+    """Backfill GeoJSON locations from the ZIP centroid table."""
+    count = asyncio.run(backfill_locations())
+    typer.echo(f"Backfilled {count} listings")
+
+async def rebuild_threads(batch_size: int = 1000) -> int:
+    """Recompute every `threads` document from the messages collection.
+    
+    Messages are grouped into threads by the database and written back in
+    batches, so memory stays bounded. Threads this run didn't write and
+    whose last message predates it have no messages left and are removed.
+    """
+    rebuild_id = str(uuid.uuid4())
+    started_at = datetime.now(timezone.utc).isoformat()
+    pipeline = [
+        {"$sort": {"created_at": 1}},
+        {"$project": {
+            "_id": 0, "id": 1, "listing_id": 1, "message": 1, "sender_id": 1, "receiver_id": 1, "created_at": 1,
+            "low": {"$min": ["$sender_id", "$receiver_id"]},
+            "high": {"$max": ["$sender_id", "$receiver_id"]},
+            "unread": {"$cond": [{"$eq": ["$read", True]}, 0, 1]},
+        }},
+        {"$group": {
+            "_id": {"listing_id": "$listing_id", "low": "$low", "high": "$high"},
+            "last_message": {"$last": "$message"},
+            "last_message_id": {"$last": "$id"},
+            "last_sender_id": {"$last": "$sender_id"},
+            "last_created_at": {"$last": "$created_at"},
+            "unread_low": {"$sum": {"$cond": [{"$eq": ["$receiver_id", "$low"]}, "$unread", 0]}},
+            "unread_high": {"$sum": {"$cond": [{"$eq": ["$receiver_id", "$high"]}, "$unread", 0]}},
+        }},
+    ]
+    count = 0
+    ops = []
+    async for row in db.messages.aggregate(pipeline, allowDiskUse=True):
+        key = row.pop("_id")
+        participants = [key["low"], key["high"]]
+        unread_counts = [(key["low"], row.pop("unread_low")), (key["high"], row.pop("unread_high"))]
+        tid = thread_id(key["listing_id"], *participants)
+        ops.append(ReplaceOne({"id": tid}, {
+            **row,
+            "id": tid,
+            "listing_id": key["listing_id"],
+            "participants": participants,
+            "unread": {user_id: n for user_id, n in unread_counts if n},
+            "rebuild_id": rebuild_id,
+        }, upsert=True))
+        if len(ops) >= batch_size:
+            await db.threads.bulk_write(ops, ordered=False)
+            count += len(ops)
+            ops = []
+    if ops:
+        await db.threads.bulk_write(ops, ordered=False)
+        count += len(ops)
+    # Threads started by messages sent during the rebuild are left alone
+    await db.threads.delete_many({
+        "rebuild_id": {"$ne": rebuild_id},
+        "last_created_at": {"$gt": "", "$lt": started_at},
+    })
+    return count
+
+@cli.command("rebuild-threads")
+def rebuild_threads_command(batch_size: int = 1000):
+    """Rebuild the message threads collection from all messages."""
+    count = asyncio.run(rebuild_threads(batch_size))
+    typer.echo(f"Rebuilt {count} threads")
+
+# One-time data migrations, run in the background on the first startup that
+# finds them unfinished in the `migrations` collection. The runner holds a lease
+# on the marker while a migration runs and only records `finished_at` once it
+# succeeds, so a failed or interrupted migration is re-run from the start on a
+# later startup (each one must therefore be safe to redo). The CLI commands can
+# re-run them at any time.
+STARTUP_MIGRATIONS = [
+    ("normalized_fields", backfill_normalized_fields),
+    ("locations", backfill_locations),
+    ("favorite_counts", reconcile_favorite_counts),
+    ("threads", rebuild_threads),
+]
+MIGRATION_LEASE_SECONDS = int(os.environ.get('MIGRATION_LEASE_SECONDS', '300'))
+
+async def claim_migration(name: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        await db.migrations.update_one(
+            {
+                "_id": name,
+                "finished_at": {"$exists": False},
+                "$or": [{"locked_until": {"$exists": False}}, {"locked_until": {"$lt": now}}],
+            },
+            {"$set": {"started_at": now, "locked_until": now + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Already finished, or another worker holds a live lease on it
+        return False
+    return True
+
+async def renew_migration_lease(name: str) -> None:
+    while True:
+        await asyncio.sleep(MIGRATION_LEASE_SECONDS / 3)
+        await db.migrations.update_one(
+            {"_id": name},
+            {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=MIGRATION_LEASE_SECONDS)}},
+        )
+
+async def run_startup_migrations() -> None:
+    for name, migrate in STARTUP_MIGRATIONS:
+        if not await claim_migration(name):
+            continue
+        heartbeat = asyncio.create_task(renew_migration_lease(name))
+        try:
+            result = await migrate()
+        except Exception as e:
+            logger.error(f"Migration {name} failed: {e}")
+            await db.migrations.update_one({"_id": name}, {"$unset": {"locked_until": ""}})
+            continue
+        finally:
+            heartbeat.cancel()
+        await db.migrations.update_one(
+            {"_id": name},
+            {"$set": {"finished_at": datetime.now(timezone.utc), "result": result}, "$unset": {"locked_until": ""}},
+        )
+        logger.info(f"Migration {name} finished: {result}")
+
+@app.on_event("startup")
+async def start_migrations_in_background():
+    app.state.migrations_task = asyncio.create_task(run_startup_migrations())
+
+@cli.command("backfill-normalized")
+def backfill_normalized_command(batch_size: int = 1000):
+    """Backfill normalized make/model fields on existing listings."""
+    count = asyncio.run(backfill_normalized_fields(batch_size))
+    typer.echo(f"Backfilled {count} listings")
+
+async def copy_local_images(concurrency: int) -> int:
+    """Copy every file under UPLOAD_DIR into the configured storage if missing."""
+    if isinstance(storage, LocalStorage):
+        return 0
+    paths = (p for p in UPLOAD_DIR.rglob("*") if p.is_file() and not p.name.startswith("."))
+    
+    async def copy_worker() -> int:
+        # Workers share the one generator, so at most `concurrency` copies run at once
+        copied = 0
+        for path in paths:
+            key = path.relative_to(UPLOAD_DIR).as_posix()
+            if await storage.exists(key):
+                continue
+            await storage.put_file(key, path, IMAGE_MEDIA_TYPES.get(path.suffix.lower(), "application/octet-stream"))
+            copied += 1
+        return copied
+    
+    return sum(await asyncio.gather(*(copy_worker() for _ in range(concurrency))))
+
+@cli.command("copy-images-to-storage")
+def copy_images_to_storage_command(concurrency: int = 16):
+    """Upload local images to the configured STORAGE_BACKEND (e.g. before switching to S3)."""
+    count = asyncio.run(copy_local_images(concurrency))
+    typer.echo(f"Copied {count} files to {STORAGE_BACKEND} storage")
+
+@cli.command("ensure-indexes")
+def ensure_indexes_command():
+    """Create all indexes declared in INDEXES."""
+    asyncio.run(ensure_indexes())
+
+@cli.command("index-report")
+def index_report_command():
+    """Explain every route's query shape and flag collection scans."""
+    report = asyncio.run(index_coverage_report())
+    for row in report:
+        status = "COLLSCAN" if row["collscan"] else "ok"
+        typer.echo(f"{status:8} {row['route']:36} {row['collection']:15} {' > '.join(row['stages'])}")
+    if any(row["collscan"] for row in report):
+        raise typer.Exit(code=1)
+
+if __name__ == "__main__":
+    cli()
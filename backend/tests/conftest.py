@@ -0,0 +1,81 @@
+"""Shared fixtures: server.py against an in-memory MongoDB (mongomock-motor)
+and a temporary local image store."""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# server.py reads these at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "nextrides_test")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import mongomock.aggregate
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+import server
+
+
+def _lookup_with_pipeline(in_collection, database, options):
+    # mongomock does not implement $lookup's `pipeline` together with
+    # localField/foreignField (MongoDB 5.0+); apply it to the joined docs
+    options = dict(options)
+    pipeline = options.pop("pipeline", None)
+    out = _lookup(in_collection, database, options)
+    if pipeline:
+        for doc in out:
+            doc[options["as"]] = list(mongomock.aggregate.process_pipeline(doc[options["as"]], database, pipeline, None))
+    return out
+
+
+_lookup = mongomock.aggregate._handle_lookup_stage
+mongomock.aggregate._PIPELINE_HANDLERS["$lookup"] = _lookup_with_pipeline
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    client = AsyncMongoMockClient()
+    database = client["nextrides_test"]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", database)
+    monkeypatch.setattr(server, "UPLOAD_DIR", tmp_path)
+    monkeypatch.setattr(server, "storage", server.LocalStorage(tmp_path))
+    # Module-level asyncio primitives bind to the first loop that waits on
+    # them; every test runs its own loop
+    monkeypatch.setattr(server, "image_slots", asyncio.Semaphore(server.IMAGE_QUEUE_LIMIT))
+    monkeypatch.setattr(server, "image_jobs_wakeup", asyncio.Event())
+    monkeypatch.setattr(server, "auth_gate", server.AdmissionGate(
+        server.AUTH_CONCURRENCY, server.AUTH_QUEUE_LIMIT, server.AUTH_QUEUE_TIMEOUT, server.AUTH_RETRY_AFTER_SECONDS))
+    server.facets_cache.clear()
+    server.makes_cache.clear()
+    server.user_cache.clear()
+    server.token_cache.clear()
+    return database
+
+
+@pytest.fixture
+def api(db):
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+def make_listing(listing_id: str, created_at: str, **fields) -> dict:
+    listing = {
+        "id": listing_id, "user_id": "seller", "make": "Toyota", "model": "Camry",
+        "make_norm": "toyota", "model_norm": "camry", "year": 2015, "mileage": 50000,
+        "price": 12000, "drive_type": "FWD", "city": "Austin", "zip_code": "78701",
+        "phone": "555-0100", "vin": "VIN", "description": "A reliable sedan.",
+        "images": [], "favorite_count": 0, "version": 1, "created_at": created_at,
+    }
+    listing.update(fields)
+    return listing
+
+
+def auth_header(user_id: str) -> dict:
+    return {"Authorization": f"Bearer {server.create_token(user_id)}"}
@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from conftest import run
+
+
+async def hold(gate, entered, release):
+    async with gate:
+        entered.set()
+        await release.wait()
+
+
+def test_gate_queues_then_sheds():
+    async def scenario():
+        gate = server.AdmissionGate(limit=1, queue_limit=1, timeout=5, retry_after=2)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(gate, entered, release))
+        await entered.wait()
+
+        queued = asyncio.create_task(hold(gate, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        assert gate.stats()["waiting"] == 1
+        with pytest.raises(server.HTTPException) as exc:
+            async with gate:
+                pass
+        assert exc.value.status_code == 429 and exc.value.headers["Retry-After"] == "2"
+
+        release.set()
+        await asyncio.gather(holder, queued)
+        stats = gate.stats()
+        assert (stats["active"], stats["waiting"], stats["admitted"], stats["shed"]) == (0, 0, 2, 1)
+    run(scenario())
+
+
+def test_gate_timeout_sheds_without_leaking_the_slot():
+    async def scenario():
+        gate = server.AdmissionGate(limit=1, queue_limit=5, timeout=0.01, retry_after=2)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(gate, entered, release))
+        await entered.wait()
+        with pytest.raises(server.HTTPException):
+            async with gate:
+                pass
+        assert gate.waiting == 0 and gate.shed == 1
+
+        release.set()
+        await holder
+        async with gate:
+            assert gate.active == 1
+        assert gate.active == 0
+    run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        gate = server.AdmissionGate(limit=1, queue_limit=5, timeout=5, retry_after=2)
+        entered, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold(gate, entered, release))
+        await entered.wait()
+        waiter = asyncio.create_task(hold(gate, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.waiting == 0
+
+        release.set()
+        await holder
+        await asyncio.wait_for(hold(gate, asyncio.Event(), release), timeout=1)
+        assert gate.active == 0 and gate.admitted == 2
+    run(scenario())
+
+
+def test_metrics_need_the_token(api, monkeypatch):
+    assert api.get("/api/metrics").status_code == 403
+    monkeypatch.setattr(server, "METRICS_TOKEN", "s3cret")
+    assert api.get("/api/metrics", headers={"Authorization": "Bearer nope"}).status_code == 403
+    response = api.get("/api/metrics", headers={"Authorization": "Bearer s3cret"})
+    assert response.status_code == 200
+    assert response.json()["auth"]["limit"] == server.AUTH_CONCURRENCY
+
+
+@pytest.mark.parametrize("host, headers, allowed", [
+    ("127.0.0.1", {}, True),
+    ("10.1.2.3", {}, True),
+    ("10.1.2.3", {"x-forwarded-for": "8.8.8.8"}, False),
+    ("8.8.8.8", {}, False),
+    ("testclient", {}, False),
+])
+def test_metrics_without_token_are_private(monkeypatch, host, headers, allowed):
+    monkeypatch.setattr(server, "METRICS_TOKEN", None)
+    request = SimpleNamespace(client=SimpleNamespace(host=host), headers=headers)
+    if allowed:
+        server.require_metrics_access(request)
+    else:
+        with pytest.raises(server.HTTPException):
+            server.require_metrics_access(request)
@@ -0,0 +1,28 @@
+from conftest import run
+
+
+def test_register_rejects_taken_email(api, db):
+    body = {"email": "ann@example.com", "password": "secret123", "name": "Ann"}
+    assert api.post("/api/auth/register", json=body).status_code == 200
+    response = api.post("/api/auth/register", json=body)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+
+
+def test_concurrent_registration_hits_unique_index(api, db, monkeypatch):
+    run(db.users.create_index("email", unique=True))
+    run(db.users.insert_one({"id": "other", "email": "ann@example.com", "name": "Ann"}))
+    find_one = type(db.users).find_one
+
+    async def not_registered_yet(collection, query, *args, **kwargs):
+        # The other registration commits between the pre-check and the insert
+        if "email" in query:
+            return None
+        return await find_one(collection, query, *args, **kwargs)
+
+    monkeypatch.setattr(type(db.users), "find_one", not_registered_yet)
+    response = api.post("/api/auth/register",
+                        json={"email": "ann@example.com", "password": "secret123", "name": "Ann 2"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+    assert run(db.users.count_documents({"email": "ann@example.com"})) == 1
@@ -0,0 +1,134 @@
+import io
+from datetime import datetime, timezone
+
+import pytest
+from PIL import Image
+from starlette.datastructures import UploadFile
+
+import server
+from conftest import auth_header, make_listing, run
+
+
+@pytest.fixture
+def blobs(db, monkeypatch):
+    # Render on the loop's default thread pool instead of spawning processes
+    monkeypatch.setattr(server, "get_image_executor", lambda: None)
+    run(db.image_blobs.create_index("hash", unique=True))
+    return db
+
+
+def jpeg_bytes(color: str) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(out, "JPEG")
+    return out.getvalue()
+
+
+def upload(data: bytes) -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data), filename="car.jpg")
+
+
+async def processed_blob(db, data: bytes) -> str:
+    """Upload data for listing "a" and run its image job; returns the blob URL."""
+    urls, jobs, _ = await server.store_uploads([upload(data)])
+    await db.listings.insert_one(make_listing("a", "2024-01-01T00:00:00+00:00", images=urls))
+    await server.enqueue_image_jobs(jobs)
+    while job := await server.claim_image_job():
+        await server.process_image_job(job)
+    [url] = (await db.listings.find_one({"id": "a"}))["images"]
+    return url
+
+
+async def refcount(db, url: str):
+    blob = await db.image_blobs.find_one({"hash": server.blob_hash(url)})
+    return blob and blob["refcount"]
+
+
+def test_reupload_reuses_blob_and_last_release_deletes_it(blobs):
+    async def scenario():
+        data = jpeg_bytes("red")
+        url = await processed_blob(blobs, data)
+        assert server.blob_hash(url)
+        assert await refcount(blobs, url) == 1
+        assert not await server.storage.exists("originals/")
+
+        urls, jobs, _ = await server.store_uploads([upload(data), upload(data)])
+        assert urls == [url, url] and jobs == []
+        assert await refcount(blobs, url) == 3
+
+        await server.release_images([url])
+        assert await refcount(blobs, url) == 2
+        assert await server.storage.exists(server.blob_key(server.blob_hash(url)))
+
+        await server.release_images(urls)
+        assert await blobs.image_blobs.count_documents({}) == 0
+        assert await blobs.image_originals.count_documents({}) == 0
+        assert not await server.storage.exists(server.blob_key(server.blob_hash(url)))
+    run(scenario())
+
+
+def test_reference_is_taken_before_checking_the_blob(blobs, monkeypatch):
+    async def scenario():
+        data = jpeg_bytes("blue")
+        url = await processed_blob(blobs, data)
+        exists = server.storage.exists
+
+        async def exists_while_listing_is_deleted(key):
+            # The only other reference goes away between reference and check
+            await server.release_images([url])
+            return await exists(key)
+
+        monkeypatch.setattr(server.storage, "exists", exists_while_listing_is_deleted)
+        urls, jobs, _ = await server.store_uploads([upload(data)])
+        assert urls == [url] and jobs == []
+        assert await refcount(blobs, url) == 1
+        assert await exists(server.blob_key(server.blob_hash(url)))
+    run(scenario())
+
+
+def test_blob_being_deleted_is_not_reused(blobs):
+    async def scenario():
+        data = jpeg_bytes("green")
+        url = await processed_blob(blobs, data)
+        content_hash = server.blob_hash(url)
+        await blobs.image_blobs.update_one(
+            {"hash": content_hash}, {"$set": {"refcount": 0, "deleting_at": datetime.now(timezone.utc)}}
+        )
+
+        [new_url], jobs, _ = await server.store_uploads([upload(data)])
+        assert new_url.startswith("/api/images/originals/") and len(jobs) == 1
+        assert await refcount(blobs, url) == 0
+        assert not await server.reference_blob(content_hash)
+    run(scenario())
+
+
+def test_stale_deletion_is_taken_over(blobs):
+    async def scenario():
+        await blobs.image_blobs.insert_one(
+            {"hash": "abc", "refcount": 0, "deleting_at": datetime(2000, 1, 1, tzinfo=timezone.utc)}
+        )
+        assert await server.reference_blob("abc", 2)
+        blob = await blobs.image_blobs.find_one({"hash": "abc"})
+        assert blob["refcount"] == 2 and "deleting_at" not in blob
+    run(scenario())
+
+
+def test_failed_listing_insert_releases_reused_blobs(blobs, api, monkeypatch):
+    data = jpeg_bytes("white")
+    url = run(processed_blob(blobs, data))
+    run(blobs.users.insert_one({"id": "seller", "email": "s@example.com", "name": "Seller",
+                                "created_at": "2024-01-01T00:00:00+00:00"}))
+
+    async def insert_fails(collection, doc, *args, **kwargs):
+        raise RuntimeError("write failed")
+
+    # Collections are created per attribute access, so patch the class
+    monkeypatch.setattr(type(blobs.listings), "insert_one", insert_fails)
+    form = {
+        "make": "Toyota", "model": "Camry", "year": "2015", "mileage": "50000", "price": "12000",
+        "drive_type": "FWD", "city": "Austin", "zip_code": "78701", "phone": "555-0100",
+        "vin": "VIN", "description": "A reliable sedan.",
+        "authorization": auth_header("seller")["Authorization"],
+    }
+    with pytest.raises(RuntimeError):
+        api.post("/api/listings", data=form, files=[("images", ("car.jpg", data, "image/jpeg"))])
+    assert run(refcount(blobs, url)) == 1
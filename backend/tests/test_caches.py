@@ -0,0 +1,100 @@
+import server
+from conftest import make_listing, run
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, "monotonic", clock)
+    cache = server.TTLCache(maxsize=4, ttl=30)
+    cache.set("k", "v")
+    clock.now += 29
+    assert cache.get("k") == "v"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.get("k", "default") == "default"
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = server.TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+
+
+def test_ttl_cache_pop_and_clear():
+    cache = server.TTLCache()
+    cache.set("a", 1)
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
+    cache.set("b", 2)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_makes_are_cached_until_invalidated(api, db):
+    run(db.listings.insert_one(make_listing("L1", "2024-01-01")))
+    first = api.get("/api/makes")
+    assert first.json() == ["Toyota"]
+    assert api.get("/api/makes", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    run(db.listings.insert_one(make_listing("L2", "2024-01-02", make="Honda", make_norm="honda",
+                                            model="Fit", model_norm="fit")))
+    assert api.get("/api/makes").json() == ["Toyota"]
+    server.invalidate_make_model_cache("honda")
+    assert api.get("/api/makes").json() == ["Honda", "Toyota"]
+    assert api.get("/api/models", params={"make": "HONDA "}).json() == ["Fit"]
+
+
+def test_user_cache_serves_until_invalidated(db):
+    async def scenario():
+        await db.users.insert_one({"id": "u1", "name": "Old", "password": "hash"})
+        token = f"Bearer {server.create_token('u1')}"
+        assert (await server.get_current_user(token))["name"] == "Old"
+        assert "password" not in server.user_cache.get("u1")
+
+        await db.users.update_one({"id": "u1"}, {"$set": {"name": "New"}})
+        assert (await server.get_current_user(token))["name"] == "Old"
+        await server.invalidate_user("u1")
+        assert (await server.get_current_user(token))["name"] == "New"
+        assert await db.cache_invalidations.count_documents({"user_id": "u1"}) == 1
+    run(scenario())
+
+
+def test_lookup_racing_an_invalidation_is_not_cached(db, monkeypatch):
+    async def scenario():
+        await db.users.insert_one({"id": "u1", "name": "Old"})
+        find_one = type(db.users).find_one
+
+        async def find_one_then_invalidate(collection, *args, **kwargs):
+            doc = await find_one(collection, *args, **kwargs)
+            server.evict_cached_user("u1")
+            return doc
+
+        monkeypatch.setattr(type(db.users), "find_one", find_one_then_invalidate)
+        assert (await server.get_current_user(server.create_token("u1")))["name"] == "Old"
+        assert server.user_cache.get("u1") is None
+    run(scenario())
+
+
+def test_token_cache_honours_expiry(db, monkeypatch):
+    token = server.create_token("u1")
+    assert server.verify_token(token) == "u1"
+    user_id, expires_at = server.token_cache.get(token)
+    assert user_id == "u1"
+
+    monkeypatch.setattr(server.time, "time", lambda: expires_at + 1)
+    assert server.verify_token(token) is None
+    assert server.token_cache.get(token) is None
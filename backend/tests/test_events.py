@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from conftest import auth_header, run
+
+
+def test_event_broker_is_abstract():
+    with pytest.raises(TypeError):
+        server.EventBroker()
+
+
+def test_local_broker_fans_out_per_user():
+    async def scenario():
+        broker = server.LocalBroker()
+        tab1, tab2 = broker.subscribe("u1"), broker.subscribe("u1")
+        other = broker.subscribe("u2")
+        await broker.publish("u1", {"type": "message", "id": "m1"})
+        assert tab1.get_nowait() == tab2.get_nowait() == {"type": "message", "id": "m1"}
+        assert other.empty()
+        assert broker.stream_count() == 3
+
+        broker.unsubscribe("u1", tab1)
+        broker.unsubscribe("u1", tab2)
+        broker.unsubscribe("u1", tab2)
+        assert broker.stream_count() == 1 and "u1" not in broker._subscribers
+    run(scenario())
+
+
+def test_slow_stream_is_told_to_resync(monkeypatch):
+    monkeypatch.setattr(server, "EVENT_QUEUE_SIZE", 2)
+
+    async def scenario():
+        broker = server.LocalBroker()
+        queue = broker.subscribe("u1")
+        for n in range(3):
+            await broker.publish("u1", {"type": "message", "id": n})
+        assert queue.get_nowait() == {"type": "resync"}
+        assert queue.empty()
+    run(scenario())
+
+
+def test_mongo_broker_needs_a_replica_set():
+    async def scenario(hello):
+        async def command(name):
+            return hello
+
+        broker = server.MongoBroker(SimpleNamespace(database=SimpleNamespace(command=command)))
+        try:
+            await broker.start()
+            return broker._task is not None
+        finally:
+            await broker.stop()
+
+    with pytest.raises(RuntimeError, match="replica set"):
+        run(scenario({"isWritablePrimary": True}))
+    assert run(scenario({"isWritablePrimary": True, "setName": "rs0"}))
+    assert run(scenario({"isWritablePrimary": True, "msg": "isdbgrid"}))
+
+
+def test_tickets_are_single_use_and_expire(db, api):
+    run(db.users.insert_one({"id": "u1", "email": "u1@example.com", "name": "U1"}))
+    assert api.post("/api/events/ticket").status_code == 401
+    ticket = api.post("/api/events/ticket", headers=auth_header("u1")).json()["ticket"]
+    assert run(db.event_tickets.find_one({}))["_id"] != ticket
+
+    assert run(server.redeem_event_ticket(ticket)) == "u1"
+    assert run(server.redeem_event_ticket(ticket)) is None
+    assert api.get("/api/events", params={"ticket": ticket}).status_code == 401
+    # The JWT itself is no longer accepted in the URL
+    assert api.get("/api/events", params={"token": server.create_token("u1")}).status_code == 401
+
+    expired = api.post("/api/events/ticket", headers=auth_header("u1")).json()["ticket"]
+    run(db.event_tickets.update_many({}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}))
+    assert run(server.redeem_event_ticket(expired)) is None
+
+
+def test_stream_delivers_events_and_unsubscribes_on_disconnect(db, monkeypatch):
+    broker = server.LocalBroker()
+    monkeypatch.setattr(server, "broker", broker)
+    monkeypatch.setattr(server, "SSE_KEEPALIVE_SECONDS", 0.01)
+
+    async def scenario():
+        ticket = (await server.create_event_ticket(auth_header("u1")["Authorization"]))["ticket"]
+        disconnected = asyncio.Event()
+        request = SimpleNamespace(is_disconnected=lambda: asyncio.sleep(0, disconnected.is_set()))
+        response = await server.stream_events(request, ticket=ticket, authorization=None)
+        chunks = response.body_iterator
+        assert await anext(chunks) == "retry: 3000\n\n"
+        assert '"count": 0' in await anext(chunks)
+        assert broker.stream_count() == 1
+
+        await broker.publish("u1", {"type": "message", "id": "m1"})
+        assert (await anext(chunks)).startswith("event: message\n")
+        assert await anext(chunks) == ": keepalive\n\n"
+
+        disconnected.set()
+        with pytest.raises(StopAsyncIteration):
+            await anext(chunks)
+        assert broker.stream_count() == 0
+    run(db.users.insert_one({"id": "u1", "email": "u1@example.com", "name": "U1"}))
+    run(scenario())
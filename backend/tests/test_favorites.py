@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from conftest import auth_header, make_listing, run
+
+
+@pytest.fixture
+def listing(db):
+    run(db.users.insert_one({"id": "buyer", "name": "Bea"}))
+    run(db.listings.insert_one(make_listing("L1", "2024-01-01T00:00:00")))
+    return "L1"
+
+
+def favorite_count(db, listing_id):
+    return run(db.listings.find_one({"id": listing_id}))["favorite_count"]
+
+
+def test_add_and_remove_favorite_maintain_count(api, db, listing):
+    headers = auth_header("buyer")
+    assert api.post("/api/favorites", json={"listing_id": listing}, headers=headers).status_code == 200
+    assert api.post("/api/favorites", json={"listing_id": listing}, headers=headers).json()["message"] == "Already in favorites"
+    assert favorite_count(db, listing) == 1
+    api.delete(f"/api/favorites/{listing}", headers=headers)
+    api.delete(f"/api/favorites/{listing}", headers=headers)
+    assert favorite_count(db, listing) == 0
+
+
+def test_reconcile_fixes_drift_in_batches(db):
+    run(db.listings.insert_many([
+        make_listing("A", "2024-01-01", favorite_count=5),
+        make_listing("B", "2024-01-02", favorite_count=0),
+        make_listing("C", "2024-01-03", favorite_count=3),
+        make_listing("D", "2024-01-04"),
+    ]))
+    run(db.favorites.insert_many([
+        {"user_id": "u1", "listing_id": "B"},
+        {"user_id": "u2", "listing_id": "B"},
+        {"user_id": "u1", "listing_id": "C"},
+        {"user_id": "u2", "listing_id": "C"},
+        {"user_id": "u3", "listing_id": "C"},
+    ]))
+    stats = run(server.reconcile_favorite_counts(batch_size=3))
+    assert stats == {"listings": 4, "updated": 2}
+    assert [favorite_count(db, i) for i in "ABCD"] == [0, 2, 3, 0]
+    # Counts that were already right keep their version (and ETag)
+    assert run(db.listings.find_one({"id": "C"}))["version"] == 1
+
+
+def test_startup_migration_runs_once(db, monkeypatch):
+    calls = []
+
+    async def migrate():
+        calls.append(1)
+        return {"ok": True}
+
+    monkeypatch.setattr(server, "STARTUP_MIGRATIONS", [("demo", migrate)])
+    run(server.run_startup_migrations())
+    run(server.run_startup_migrations())
+    assert calls == [1]
+    assert run(db.migrations.find_one({"_id": "demo"}))["result"] == {"ok": True}
+
+
+def test_failed_startup_migration_is_retried(db, monkeypatch):
+    async def broken():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server, "STARTUP_MIGRATIONS", [("demo", broken)])
+    run(server.run_startup_migrations())
+    marker = run(db.migrations.find_one({"_id": "demo"}))
+    assert "finished_at" not in marker and "locked_until" not in marker
+    assert run(server.claim_migration("demo"))
+
+
+def test_interrupted_startup_migration_is_rerun_after_its_lease(db, monkeypatch):
+    calls = []
+
+    async def migrate():
+        calls.append(1)
+        return {"ok": True}
+
+    monkeypatch.setattr(server, "STARTUP_MIGRATIONS", [("demo", migrate)])
+    now = datetime.now(timezone.utc)
+    # A worker crashed mid-run and its lease is still live: leave it alone
+    run(db.migrations.insert_one({"_id": "demo", "started_at": now, "locked_until": now + timedelta(minutes=5)}))
+    run(server.run_startup_migrations())
+    assert calls == []
+
+    run(db.migrations.update_one({"_id": "demo"}, {"$set": {"locked_until": now - timedelta(seconds=1)}}))
+    run(server.run_startup_migrations())
+    assert calls == [1]
+    assert "finished_at" in run(db.migrations.find_one({"_id": "demo"}))
+
+
+def test_startup_backfills_favorite_counts(db):
+    run(db.listings.insert_one(make_listing("L1", "2024-01-01", favorite_count=None)))
+    run(db.favorites.insert_one({"user_id": "u1", "listing_id": "L1"}))
+    run(server.run_startup_migrations())
+    assert favorite_count(db, "L1") == 1
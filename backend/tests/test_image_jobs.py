@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+from conftest import auth_header, make_listing, run
+
+ORIGINAL_KEY = "originals/o1.jpg"
+ORIGINAL_URL = f"/api/images/{ORIGINAL_KEY}"
+
+
+async def queued_original(db):
+    await server.storage.put(ORIGINAL_KEY, b"original", "image/jpeg")
+    await db.listings.insert_one(make_listing("a", "2024-01-01T00:00:00+00:00", images=[ORIGINAL_URL]))
+    await server.enqueue_image_jobs([("o1", ORIGINAL_KEY)])
+
+
+def test_claim_leases_job_until_it_expires(db):
+    async def scenario():
+        await queued_original(db)
+        job = await server.claim_image_job()
+        assert job["status"] == "processing" and job["attempts"] == 1
+        assert await server.claim_image_job() is None
+
+        await db.image_jobs.update_one(
+            {"_id": job["_id"]}, {"$set": {"locked_until": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+        )
+        reclaimed = await server.claim_image_job()
+        assert reclaimed["_id"] == job["_id"] and reclaimed["attempts"] == 2
+    run(scenario())
+
+
+def test_failed_attempt_backs_off(db):
+    async def scenario():
+        await queued_original(db)
+        job = await server.claim_image_job()
+        before = datetime.now(timezone.utc).replace(tzinfo=None)
+        await server.retry_image_job(job, RuntimeError("storage unavailable"))
+
+        stored = await db.image_jobs.find_one({"_id": job["_id"]})
+        locked_until = stored["locked_until"].replace(tzinfo=None)
+        assert stored["status"] == "processing"
+        assert locked_until >= before + timedelta(seconds=server.IMAGE_JOB_RETRY_SECONDS - 1)
+        assert await server.claim_image_job() is None
+        assert await server.storage.exists(ORIGINAL_KEY)
+    run(scenario())
+
+
+def test_last_attempt_fails_job(db):
+    async def scenario():
+        await queued_original(db)
+        job = await server.claim_image_job()
+        job["attempts"] = server.IMAGE_JOB_MAX_ATTEMPTS
+        await server.retry_image_job(job, RuntimeError("storage unavailable"))
+
+        listing = await db.listings.find_one({"id": "a"})
+        assert listing["images"] == [] and listing["image_errors"] == ["Image could not be processed"]
+        assert listing["version"] == 2
+        assert await db.image_jobs.count_documents({}) == 0
+        assert not await server.storage.exists(ORIGINAL_KEY)
+    run(scenario())
+
+
+def test_job_for_deleted_listing_drops_original(db):
+    async def scenario():
+        await queued_original(db)
+        await db.listings.delete_one({"id": "a"})
+        await server.process_image_job(await server.claim_image_job())
+        assert await db.image_jobs.count_documents({}) == 0
+        assert not await server.storage.exists(ORIGINAL_KEY)
+    run(scenario())
+
+
+def test_requeue_orphaned_originals(db):
+    async def scenario():
+        await db.listings.insert_many([
+            make_listing("a", "2024-01-01T00:00:00+00:00", images=[ORIGINAL_URL, server.blob_url("h1")]),
+            make_listing("b", "2024-01-02T00:00:00+00:00", images=["/api/images/originals/o2.png"]),
+        ])
+        await server.enqueue_image_jobs([("o2", "originals/o2.png")])
+        assert await server.requeue_orphaned_originals() == 1
+        job = await db.image_jobs.find_one({"original_hash": "o1"})
+        assert job["original_key"] == ORIGINAL_KEY and job["status"] == "pending"
+        assert await server.requeue_orphaned_originals() == 0
+    run(scenario())
+
+
+def test_pending_originals_are_never_served(db, api):
+    run(server.storage.put(ORIGINAL_KEY, b"original" * 1000, "image/jpeg"))
+    for size in server.IMAGE_RENDITIONS:
+        response = api.get(ORIGINAL_URL, params={"size": size})
+        assert response.status_code == 200 and response.headers["cache-control"] == "no-store"
+        assert response.content == server.pending_image_placeholder(size)
+    assert api.get(ORIGINAL_URL).content == server.pending_image_placeholder("full")
+    assert api.get("/api/images/originals/gone.jpg", params={"size": "card"}).status_code == 404
+
+
+def test_update_keeps_blob_that_replaced_a_shown_original(db, api):
+    blob = server.blob_url("h1")
+    run(db.users.insert_one({"id": "seller", "email": "s@example.com", "name": "Seller",
+                             "created_at": "2024-01-01T00:00:00+00:00"}))
+    # The editor loaded the listing before the job swapped o1 for its blob
+    run(db.listings.insert_one(make_listing("a", "2024-01-01T00:00:00+00:00", images=[blob, server.blob_url("h2")],
+                                            version=3)))
+    run(db.image_originals.insert_one({"original_hash": "o1", "hash": "h1"}))
+    run(db.image_blobs.insert_many([{"hash": "h1", "refcount": 1}, {"hash": "h2", "refcount": 2}]))
+
+    response = api.put("/api/listings/a", json={"images": [ORIGINAL_URL], "price": 9000},
+                       headers=auth_header("seller"))
+    assert response.status_code == 200
+    assert response.json()["images"] == [blob]
+    listing = run(db.listings.find_one({"id": "a"}))
+    assert listing["images"] == [blob] and listing["price"] == 9000 and listing["version"] == 4
+    assert run(db.image_blobs.find_one({"hash": "h2"}))["refcount"] == 1
+
+    unknown = api.put("/api/listings/a", json={"images": ["/api/images/originals/o9.jpg"]},
+                      headers=auth_header("seller"))
+    assert unknown.status_code == 400
+
+
+def test_update_retries_when_a_job_swaps_images_meanwhile(db, api, monkeypatch):
+    blob = server.blob_url("h1")
+    run(db.users.insert_one({"id": "seller", "email": "s@example.com", "name": "Seller",
+                             "created_at": "2024-01-01T00:00:00+00:00"}))
+    run(db.listings.insert_one(make_listing("a", "2024-01-01T00:00:00+00:00", images=[ORIGINAL_URL])))
+    find_one = type(db.listings).find_one
+    swapped = []
+
+    async def find_one_then_swap(collection, *args, **kwargs):
+        doc = await find_one(collection, *args, **kwargs)
+        if collection.name == "listings" and not swapped:
+            swapped.append(True)
+            await db.image_originals.insert_one({"original_hash": "o1", "hash": "h1"})
+            await db.listings.update_one({"id": "a"}, {"$set": {"images": [blob]}, "$inc": {"version": 1}})
+        return doc
+
+    monkeypatch.setattr(type(db.listings), "find_one", find_one_then_swap)
+    response = api.put("/api/listings/a", json={"images": [ORIGINAL_URL], "price": 9000},
+                       headers=auth_header("seller"))
+    assert response.status_code == 200
+    listing = run(db.listings.find_one({"id": "a"}))
+    assert listing["images"] == [blob] and listing["price"] == 9000 and listing["version"] == 3
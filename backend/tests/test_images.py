@@ -0,0 +1,128 @@
+import asyncio
+import io
+import time
+
+import pytest
+from PIL import Image
+
+import server
+from conftest import run
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=90-200", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    (" Bytes = 5-5", (5, 5)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=abc", None),
+    ("bytes=-0", None),
+    ("bytes=9-3", None),
+])
+def test_parse_byte_range(header, expected):
+    assert server.parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=100-", 100), ("bytes=-5", 0)])
+def test_unsatisfiable_range_is_416(header, size):
+    with pytest.raises(server.HTTPException) as exc:
+        server.parse_byte_range(header, size)
+    assert exc.value.status_code == 416
+    assert exc.value.headers["Content-Range"] == f"bytes */{size}"
+
+
+@pytest.fixture
+def blob(db):
+    data = bytes(range(256)) * 4
+    key = f"{server.BLOB_PREFIX}/{'a' * 64}.jpg"
+    run(server.storage.put(key, data, "image/jpeg"))
+    return f"/api/images/{key}", data
+
+
+def test_blob_range_and_revalidation(api, blob):
+    url, data = blob
+    full = api.get(url)
+    assert full.content == data
+    assert "immutable" in full.headers["Cache-Control"]
+
+    partial = api.get(url, headers={"Range": "bytes=10-19"})
+    assert partial.status_code == 206
+    assert partial.content == data[10:20]
+    assert partial.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+
+    assert api.get(url, headers={"If-None-Match": full.headers["ETag"]}).status_code == 304
+    # A stale If-Range validator sends the whole file
+    stale = api.get(url, headers={"Range": "bytes=10-19", "If-Range": '"other"'})
+    assert stale.status_code == 200
+    assert api.get(url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+
+
+AVIF = ("image/avif", "avif", "AVIF", {})
+WEBP = ("image/webp", "webp", "WEBP", {"quality": 80})
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, None),
+    ("", None),
+    ("image/*,*/*;q=0.8", None),
+    ("image/webp,image/*", WEBP),
+    ("image/avif,image/webp,image/apng,*/*;q=0.8", AVIF),
+    ("IMAGE/WEBP", WEBP),
+    ("image/avif;q=0, image/webp;q=0.5", WEBP),
+    ("image/avif; q=0.0", None),
+])
+def test_negotiate_image_variant(monkeypatch, accept, expected):
+    monkeypatch.setattr(server, "IMAGE_VARIANTS", [AVIF, WEBP])
+    assert server.negotiate_image_variant(accept) == expected
+
+
+@pytest.fixture
+def photo(db, monkeypatch):
+    monkeypatch.setattr(server, "get_image_executor", lambda: None)
+    monkeypatch.setattr(server, "IMAGE_VARIANTS", [WEBP])
+    out = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").resize((800, 600)).save(out, "JPEG", quality=95)
+    key = f"{server.BLOB_PREFIX}/{'b' * 64}.jpg"
+    run(server.storage.put(key, out.getvalue(), "image/jpeg"))
+    return key
+
+
+def test_variant_is_transcoded_in_the_background(photo):
+    async def scenario():
+        assert await server.image_variant(photo, WEBP) is None
+        assert await server.image_variant(photo, WEBP) is None
+        assert len(server._variant_tasks) == 1
+        await asyncio.gather(*server._variant_tasks.values())
+        key, stored = await server.image_variant(photo, WEBP)
+        assert key.endswith(".webp") and 0 < stored.size < (await server.storage.stat(photo)).size
+    run(scenario())
+
+
+def test_variant_that_is_not_smaller_serves_the_jpeg(photo, monkeypatch):
+    monkeypatch.setattr(server, "transcode_image", lambda data, *args: data + b"!")
+
+    async def scenario():
+        assert await server.image_variant(photo, WEBP) is None
+        await asyncio.gather(*server._variant_tasks.values())
+        assert (await server.storage.stat(photo.replace(".jpg", ".webp"))).size == 0
+        assert await server.image_variant(photo, WEBP) is None
+        assert not server._variant_tasks
+    run(scenario())
+
+
+def test_image_responses_vary_on_accept(photo, api):
+    url = f"/api/images/{photo}"
+    first = api.get(url, headers={"Accept": "image/webp"})
+    assert first.headers["content-type"] == "image/jpeg" and first.headers["vary"] == "Accept"
+    for _ in range(100):
+        if run(server.storage.exists(photo.replace(".jpg", ".webp"))):
+            break
+        time.sleep(0.01)
+    webp = api.get(url, headers={"Accept": "image/webp"})
+    assert webp.headers["content-type"] == "image/webp" and webp.headers["vary"] == "Accept"
+    assert api.get(url, headers={"If-None-Match": webp.headers["etag"], "Accept": "image/webp"}).status_code == 304
+    jpeg = api.get(url)
+    assert jpeg.headers["content-type"] == "image/jpeg" and jpeg.headers["vary"] == "Accept"
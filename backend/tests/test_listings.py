@@ -0,0 +1,123 @@
+import math
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from conftest import make_listing, run
+
+
+@pytest.fixture
+def listings(db):
+    # Two listings share a timestamp so the id tiebreak is exercised
+    docs = [make_listing(f"L{i}", f"2024-01-0{min(i, 4) + 1}T00:00:00") for i in range(6)]
+    run(db.listings.insert_many(docs))
+    run(db.users.insert_one({"id": "seller", "name": "Sam"}))
+    return docs
+
+
+def test_keyset_cursor_round_trip():
+    cursor = server.encode_keyset_cursor("2024-01-01T00:00:00", "abc")
+    assert server.decode_keyset_cursor(cursor) == ("2024-01-01T00:00:00", "abc")
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "WzFd", "e30="])
+def test_invalid_cursor_is_400(cursor):
+    with pytest.raises(server.HTTPException) as exc:
+        server.decode_keyset_cursor(cursor)
+    assert exc.value.status_code == 400
+
+
+def test_cursor_pages_cover_every_listing_once(api, listings):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = api.get("/api/listings", params=params)
+        assert response.status_code == 200
+        seen += [listing["id"] for listing in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["L5", "L4", "L3", "L2", "L1", "L0"]
+
+
+def test_listings_join_seller_name(api, listings):
+    assert {listing["user_name"] for listing in api.get("/api/listings").json()} == {"Sam"}
+
+
+def test_listings_revalidate_without_the_seller_join(api, db, listings, monkeypatch):
+    first = api.get("/api/listings", params={"limit": 3})
+    etag = first.headers["ETag"]
+
+    calls = []
+    original = server.listing_enrichment_stages
+    monkeypatch.setattr(server, "listing_enrichment_stages", lambda: calls.append(1) or original())
+    cached = api.get("/api/listings", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert calls == []
+
+    # A seller rename changes the page even though no listing changed
+    run(db.users.update_one({"id": "seller"}, {"$set": {"nickname": "Sammy"}}))
+    changed = api.get("/api/listings", params={"limit": 3}, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()[0]["user_name"] == "Sammy"
+
+    run(db.listings.update_one({"id": "L5"}, {"$inc": {"version": 1}}))
+    fresh = api.get("/api/listings", params={"limit": 3}, headers={"If-None-Match": changed.headers["ETag"]})
+    assert fresh.status_code == 200
+
+
+def test_startup_backfills_normalized_make_and_model(db):
+    legacy = make_listing("L1", "2024-01-01", make="Škoda", model=" Octavia ")
+    del legacy["make_norm"], legacy["model_norm"]
+    # Left behind by the old $toLower backfill, which only folds ASCII
+    stale = make_listing("L2", "2024-01-02", make="ŠKODA", model="Fabia", make_norm="Škoda", model_norm="fabia")
+    run(db.listings.insert_many([legacy, stale]))
+    run(server.run_startup_migrations())
+
+    with TestClient(server.app) as api:
+        assert api.get("/api/makes").json() == ["Škoda"]
+        assert api.get("/api/models", params={"make": "ŠKODA"}).json() == ["Fabia", "Octavia"]
+        found = api.get("/api/listings", params={"make": "škoda"}).json()
+    assert sorted(listing["id"] for listing in found) == ["L1", "L2"]
+    assert run(server.backfill_normalized_fields()) == 0
+
+
+def emulate_geo_near(monkeypatch, db):
+    """mongomock has no $geoNear; match the ZIP centroids within range instead."""
+    aggregate = type(db.listings).aggregate
+
+    def miles(a, b):
+        (lon1, lat1), (lon2, lat2) = map(math.radians, a), map(math.radians, b)
+        h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+        return 2 * server.EARTH_RADIUS_MILES * math.asin(math.sqrt(h))
+
+    def geo_aggregate(collection, pipeline, *args, **kwargs):
+        if "$geoNear" in pipeline[0]:
+            stage = pipeline[0]["$geoNear"]
+            radius = stage["maxDistance"] / server.METERS_PER_MILE
+            points = [
+                {"type": "Point", "coordinates": list(coords)}
+                for coords in server.load_zip_centroids().values()
+                if miles(coords, stage["near"]["coordinates"]) <= radius
+            ]
+            pipeline = [{"$match": {**stage["query"], "location": {"$in": points}}}, *pipeline[1:]]
+        return aggregate(collection, pipeline, *args, **kwargs)
+
+    monkeypatch.setattr(type(db.listings), "aggregate", geo_aggregate)
+
+
+def test_startup_backfills_locations_for_radius_search(db, monkeypatch):
+    emulate_geo_near(monkeypatch, db)
+    run(db.listings.insert_many([
+        make_listing("L1", "2024-01-01", zip_code="78702"),
+        make_listing("L2", "2024-01-02", zip_code="10001"),
+    ]))
+    run(server.run_startup_migrations())
+
+    with TestClient(server.app) as api:
+        found = api.get("/api/listings", params={"zip_code": "78701", "distance": 25}).json()
+    assert [listing["id"] for listing in found] == ["L1"]
+    assert run(db.listings.find_one({"id": "L2"}))["location"] == server.zip_location("10001")
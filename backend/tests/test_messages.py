@@ -0,0 +1,75 @@
+import server
+from conftest import auth_header, make_listing, run
+
+
+def seed_conversation(db):
+    run(db.users.insert_many([
+        {"id": "ann", "email": "ann@example.com", "name": "Ann"},
+        {"id": "bob", "email": "bob@example.com", "name": "Bob"},
+    ]))
+    run(db.listings.insert_one(make_listing("L1", "2024-01-01T00:00:00+00:00")))
+    messages = [
+        {"id": f"m{n}", "listing_id": "L1", "sender_id": "ann" if n % 2 else "bob",
+         "receiver_id": "bob" if n % 2 else "ann", "message": f"hi {n}", "read": False,
+         # Pairs share a timestamp, so the id tiebreak matters
+         "created_at": f"2024-01-01T10:00:0{n // 2}"}
+        for n in range(7)
+    ]
+    messages.append({"id": "x1", "listing_id": "L2", "sender_id": "ann", "receiver_id": "bob",
+                     "message": "other listing", "read": False, "created_at": "2024-01-01T10:00:09"})
+    run(db.messages.insert_many(messages))
+
+
+def test_conversation_pages_with_keyset_cursor(db, api):
+    seed_conversation(db)
+    seen, cursor = [], None
+    while True:
+        params = {"listing_id": "L1", "other_user_id": "bob", "limit": 3}
+        if cursor:
+            params["before"] = cursor
+        response = api.get("/api/messages/conversation", params=params, headers=auth_header("ann"))
+        assert response.status_code == 200
+        page = response.json()
+        seen += [msg["id"] for msg in page]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["m6", "m5", "m4", "m3", "m2", "m1", "m0"]
+    assert page[-1]["sender_name"] == "Bob" and page[-1]["listing_title"] == "2015 Toyota Camry"
+
+
+def test_conversation_rejects_bad_cursor(db, api):
+    seed_conversation(db)
+    response = api.get("/api/messages/conversation", params={"listing_id": "L1", "other_user_id": "bob",
+                                                             "before": "not-a-cursor"}, headers=auth_header("ann"))
+    assert response.status_code == 400
+
+
+def test_threads_page_with_keyset_cursor(db, api):
+    run(db.users.insert_one({"id": "ann", "email": "ann@example.com", "name": "Ann"}))
+    run(db.threads.insert_many([
+        {"id": server.thread_id(f"L{n}", "ann", "bob"), "listing_id": f"L{n}", "participants": ["ann", "bob"],
+         "unread": {"ann": n}, "last_message": "hi", "last_created_at": f"2024-01-0{1 + n // 2}T00:00:00"}
+        for n in range(5)
+    ]))
+    seen, cursor = [], None
+    while True:
+        response = api.get("/api/messages/threads", params={"limit": 2, **({"cursor": cursor} if cursor else {})},
+                           headers=auth_header("ann"))
+        seen += [thread["listing_id"] for thread in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == ["L4", "L3", "L2", "L1", "L0"]
+
+
+def test_ensure_indexes_drops_superseded_message_index(db):
+    async def scenario():
+        await db.messages.create_index([("listing_id", 1), ("receiver_id", 1), ("sender_id", 1)])
+        await server.ensure_indexes()
+        names = set(await db.messages.index_information())
+        assert "listing_id_1_receiver_id_1_sender_id_1" not in names
+        assert "listing_id_1_receiver_id_1_sender_id_1_created_at_-1_id_-1" in names
+        # Nothing left to drop the second time
+        await server.ensure_indexes()
+    run(scenario())
@@ -0,0 +1,95 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+import server
+
+
+def jpeg(size: tuple) -> bytes:
+    out = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").resize(size).save(out, "JPEG", quality=90)
+    return out.getvalue()
+
+
+def test_jpeg_draft_scales_with_the_aspect_ratio():
+    # 4:3 at 2.5x the target: decoded at 1/2 scale, never below the target
+    with server.open_image(jpeg((4000, 3000)), 1600) as img:
+        assert img.size == (2000, 1500)
+    assert server.prepare_image(jpeg((4000, 3000))).size == (1600, 1200)
+    with server.open_image(jpeg((3000, 4000)), 1600) as img:
+        assert img.size == (1500, 2000)
+    # Centre crops need the shortest side at the target instead
+    with server.open_image(jpeg((4000, 1000)), 256, cover=True) as img:
+        assert img.size == (2000, 500)
+
+
+def noise(size: tuple) -> Image.Image:
+    return Image.frombytes("RGB", size, random.Random(0).randbytes(size[0] * size[1] * 3))
+
+
+def test_high_entropy_image_is_shrunk_under_the_limit():
+    img = noise((800, 600))
+    assert len(server._encode_jpeg(img, server.JPEG_MIN_QUALITY)) > 100 * 1024
+    data = server.encode_jpeg_under(img, 100 * 1024)
+    assert len(data) <= 100 * 1024
+    with Image.open(io.BytesIO(data)) as out:
+        assert out.format == "JPEG" and out.size[0] < 800
+        assert out.size[0] / out.size[1] == pytest.approx(4 / 3, abs=0.01)
+
+
+def test_quality_drops_before_the_image_is_shrunk():
+    img = noise((200, 150))
+    best = server._encode_jpeg(img, server.JPEG_MAX_QUALITY)
+    lowest = server._encode_jpeg(img, server.JPEG_MIN_QUALITY)
+    # Fits at the highest quality: encoded once at JPEG_MAX_QUALITY
+    assert server.encode_jpeg_under(img, len(best)) == best
+    # Between the bounds: a lower quality at full size, as large as allowed
+    budget = (len(best) + len(lowest)) // 2
+    data = server.encode_jpeg_under(img, budget)
+    assert len(lowest) <= len(data) <= budget
+    assert Image.open(io.BytesIO(data)).size == (200, 150)
+    # Below the lowest quality: only then is the image downscaled
+    data = server.encode_jpeg_under(img, len(lowest) - 1)
+    assert len(data) < len(lowest)
+    assert Image.open(io.BytesIO(data)).size[0] < 200
+
+
+@pytest.mark.parametrize("size", [(2400, 1800), (1800, 2400)])
+def test_renditions_fit_their_dimensions_and_budgets(size):
+    source = io.BytesIO()
+    Image.effect_noise(size, 90).convert("RGB").save(source, "JPEG", quality=95)
+    renditions = server.render_image(source.getvalue())
+    assert renditions.keys() == server.IMAGE_RENDITIONS.keys()
+    for name, (max_dimension, max_size) in server.IMAGE_RENDITIONS.items():
+        assert len(renditions[name]) <= max_size
+        with Image.open(io.BytesIO(renditions[name])) as img:
+            assert img.format == "JPEG"
+            assert max(img.size) <= max_dimension
+            # Orientation is kept and only shrunk further to meet the byte budget
+            assert (img.size[0] > img.size[1]) == (size[0] > size[1])
+            assert img.size[0] / img.size[1] == pytest.approx(size[0] / size[1], rel=0.01)
+
+
+@pytest.mark.parametrize("size, expected", [
+    ((4000, 3000), {"full": (1600, 1200), "card": (800, 600), "thumb": (320, 240)}),
+    ((3000, 4000), {"full": (1200, 1600), "card": (600, 800), "thumb": (240, 320)}),
+])
+def test_renditions_of_a_large_photo_hit_their_longest_side(size, expected):
+    renditions = server.render_image(jpeg(size))
+    for name, data in renditions.items():
+        assert len(data) <= server.IMAGE_RENDITIONS[name][1]
+        assert Image.open(io.BytesIO(data)).size == expected[name]
+
+
+@pytest.mark.parametrize("size", [(1200, 400), (600, 900)])
+def test_avatar_renditions_are_squares_within_budget(size):
+    source = io.BytesIO()
+    Image.effect_noise(size, 90).convert("RGB").save(source, "JPEG", quality=95)
+    renditions = server.render_avatar(source.getvalue())
+    assert renditions.keys() == server.AVATAR_RENDITIONS.keys()
+    for name, (side, max_size) in server.AVATAR_RENDITIONS.items():
+        assert len(renditions[name]) <= max_size
+        with Image.open(io.BytesIO(renditions[name])) as img:
+            assert img.size == (side, side)
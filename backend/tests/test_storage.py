@@ -0,0 +1,119 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import server
+from conftest import run
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "local":
+        yield server.LocalStorage(tmp_path)
+        return
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+        monkeypatch.setenv(name, "testing")
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="images")
+        yield server.S3Storage("images", region="us-east-1", key_prefix="app/")
+
+
+def test_image_storage_is_abstract():
+    with pytest.raises(TypeError):
+        server.ImageStorage()
+
+
+def test_put_stat_and_read(store):
+    async def scenario():
+        assert await store.stat("blobs/a.jpg") is None
+        assert not await store.exists("blobs/a.jpg")
+        await store.put("blobs/a.jpg", DATA, "image/jpeg")
+        stored = await store.stat("blobs/a.jpg")
+        assert stored.size == len(DATA) and stored.etag
+        assert await store.read("blobs/a.jpg") == DATA
+        assert await store.read("blobs/a.jpg", 10, 19) == DATA[10:20]
+        assert await store.read("blobs/a.jpg", 10000) == DATA[10000:]
+        await store.put("blobs/a.jpg", b"new", "image/jpeg")
+        assert await store.read("blobs/a.jpg") == b"new"
+    run(scenario())
+
+
+def test_stream_in_chunks(store, monkeypatch):
+    monkeypatch.setattr(server, "STORAGE_STREAM_CHUNK_BYTES", 1000)
+
+    async def collect(*args):
+        return [chunk async for chunk in store.stream("blobs/a.jpg", *args)]
+
+    async def scenario():
+        await store.put("blobs/a.jpg", DATA, "image/jpeg")
+        chunks = await collect()
+        assert b"".join(chunks) == DATA
+        assert max(map(len, chunks)) <= 1000 and len(chunks) > 1
+        assert b"".join(await collect(500, 2600)) == DATA[500:2601]
+    run(scenario())
+
+
+def test_delete_prefix(store):
+    async def scenario():
+        for key in ("blobs/ab.jpg", "blobs/ab_card.jpg", "blobs/abc.jpg", "blobs/b.jpg", "listing/1.jpg"):
+            await store.put(key, b"x", "image/jpeg")
+        await store.delete_prefix("blobs/ab")
+        assert [await store.exists(key) for key in ("blobs/ab.jpg", "blobs/ab_card.jpg", "blobs/abc.jpg")] == [
+            False, False, False
+        ]
+        assert await store.exists("blobs/b.jpg")
+        await store.delete_prefix("listing/")
+        assert not await store.exists("listing/1.jpg")
+        assert await store.exists("blobs/b.jpg")
+    run(scenario())
+
+
+def test_image_route_serves_storage_objects(store, db, api, monkeypatch):
+    monkeypatch.setattr(server, "storage", store)
+    monkeypatch.setattr(server, "STORAGE_STREAM_CHUNK_BYTES", 1000)
+    run(store.put("blobs/a.jpg", DATA, "image/jpeg"))
+
+    full = api.get("/api/images/blobs/a.jpg")
+    assert full.status_code == 200
+    assert full.content == DATA and full.headers["content-length"] == str(len(DATA))
+
+    partial = api.get("/api/images/blobs/a.jpg", headers={"Range": "bytes=1000-2999"})
+    assert partial.status_code == 206
+    assert partial.content == DATA[1000:3000]
+    assert partial.headers["content-range"] == f"bytes 1000-2999/{len(DATA)}"
+
+
+def test_put_file_copies_without_reading_it_whole(store, tmp_path_factory, monkeypatch):
+    source = tmp_path_factory.mktemp("spool") / "upload"
+    source.write_bytes(DATA)
+
+    def read_bytes(path):
+        raise AssertionError("file read into memory")
+
+    monkeypatch.setattr(server.Path, "read_bytes", read_bytes)
+
+    async def scenario():
+        await store.put_file("originals/a.jpg", source, "image/jpeg")
+        assert await store.read("originals/a.jpg") == DATA
+        assert source.exists()
+    run(scenario())
+
+
+def test_copy_local_images(store, tmp_path_factory, monkeypatch):
+    uploads = tmp_path_factory.mktemp("uploads")
+    for name in ("1.jpg", "2.png", ".tmp"):
+        (uploads / "listing" / name).parent.mkdir(exist_ok=True)
+        (uploads / "listing" / name).write_bytes(DATA)
+    monkeypatch.setattr(server, "UPLOAD_DIR", uploads)
+    monkeypatch.setattr(server, "storage", store)
+    if isinstance(store, server.LocalStorage):
+        assert run(server.copy_local_images(2)) == 0
+        return
+
+    run(store.put("listing/1.jpg", b"already copied", "image/jpeg"))
+    assert run(server.copy_local_images(2)) == 1
+    assert run(store.read("listing/1.jpg")) == b"already copied"
+    assert run(store.read("listing/2.png")) == DATA
+    assert not run(store.exists("listing/.tmp"))
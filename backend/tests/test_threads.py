@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+from conftest import run
+
+TID = server.thread_id("L1", "bob", "ann")
+
+
+def message(msg_id, sender, receiver, created_at, read=False, listing_id="L1"):
+    return {
+        "id": msg_id, "listing_id": listing_id, "sender_id": sender, "receiver_id": receiver,
+        "message": f"text {msg_id}", "read": read, "created_at": created_at,
+    }
+
+
+def test_thread_counters_follow_messages_and_reads(db):
+    async def scenario():
+        await server.record_thread_message(message("m1", "ann", "bob", "2024-01-01T10:00:00"))
+        await server.record_thread_message(message("m3", "bob", "ann", "2024-01-01T12:00:00"))
+        # Arrives late: counted, but doesn't replace the newer last message
+        await server.record_thread_message(message("m2", "ann", "bob", "2024-01-01T11:00:00"))
+
+        thread = await db.threads.find_one({"id": TID})
+        assert thread["participants"] == ["ann", "bob"]
+        assert thread["unread"] == {"bob": 2, "ann": 1}
+        assert (thread["last_message_id"], thread["last_sender_id"]) == ("m3", "bob")
+
+        await server.record_thread_reads("L1", "bob", "ann", 2)
+        await server.record_thread_reads("L1", "ann", "bob", 0)
+        thread = await db.threads.find_one({"id": TID})
+        assert thread["unread"] == {"bob": 0, "ann": 1}
+    run(scenario())
+
+
+def test_rebuild_threads_matches_messages(db):
+    async def scenario():
+        now = datetime.now(timezone.utc)
+        await db.messages.insert_many([
+            message("m1", "ann", "bob", "2024-01-01T10:00:00", read=True),
+            message("m2", "bob", "ann", "2024-01-01T11:00:00"),
+            message("m3", "bob", "ann", "2024-01-01T12:00:00"),
+            message("m4", "cat", "ann", "2024-01-02T09:00:00", listing_id="L2"),
+            message("m5", "ann", "cat", "2024-01-02T08:00:00", listing_id="L2"),
+        ])
+        await db.threads.insert_many([
+            # Drifted counters, rebuilt
+            {"id": TID, "listing_id": "L1", "participants": ["ann", "bob"], "unread": {"ann": 7},
+             "last_created_at": "2024-01-01T10:00:00"},
+            # Messages deleted since, removed
+            {"id": server.thread_id("L9", "ann", "dan"), "last_created_at": "2023-06-01T00:00:00"},
+            # Started by a message sent during the rebuild, kept
+            {"id": server.thread_id("L9", "ann", "eve"), "last_created_at": (now + timedelta(seconds=5)).isoformat()},
+        ])
+
+        assert await server.rebuild_threads(batch_size=1) == 2
+        threads = {t["id"]: t async for t in db.threads.find({}, {"_id": 0})}
+        assert set(threads) == {TID, server.thread_id("L2", "ann", "cat"), server.thread_id("L9", "ann", "eve")}
+        l1 = threads[TID]
+        assert l1["unread"] == {"ann": 2}
+        assert (l1["last_message_id"], l1["last_created_at"]) == ("m3", "2024-01-01T12:00:00")
+        l2 = threads[server.thread_id("L2", "ann", "cat")]
+        assert l2["participants"] == ["ann", "cat"]
+        assert l2["unread"] == {"ann": 1, "cat": 1}
+        assert l2["last_message_id"] == "m4"
+    run(scenario())
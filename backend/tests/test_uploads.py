@@ -0,0 +1,99 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import server
+from conftest import auth_header, run
+
+
+def limited_app(received):
+    inner = FastAPI()
+
+    @inner.post("/upload")
+    async def upload(request: Request):
+        body = await request.body()
+        received.append(len(body))
+        return {"size": len(body)}
+
+    return server.RequestSizeLimit(inner, max_bytes=1024, path_limits={"/small": 10})
+
+
+def test_request_size_limit_rejects_by_content_length():
+    received = []
+    client = TestClient(limited_app(received))
+    assert client.post("/upload", content=b"x" * 1024).json() == {"size": 1024}
+    response = client.post("/upload", content=b"x" * 1025)
+    assert response.status_code == 413
+    assert received == [1024]
+
+
+def test_request_size_limit_cuts_off_chunked_bodies():
+    received = []
+    client = TestClient(limited_app(received))
+
+    def chunks():
+        for _ in range(4):
+            yield b"x" * 512
+
+    assert client.post("/upload", content=chunks()).status_code == 413
+    assert received == []
+
+
+def test_avatar_route_has_its_own_limit(api, db):
+    oversized = b"\xff\xd8" + b"0" * (server.AVATAR_MAX_UPLOAD_BYTES + server.MULTIPART_OVERHEAD_BYTES)
+    response = api.post(
+        "/api/profile/avatar",
+        files={"avatar": ("a.jpg", oversized, "image/jpeg")},
+        data={"authorization": auth_header("u1")["Authorization"]},
+    )
+    assert response.status_code == 413
+
+
+def test_avatar_upload_replaces_the_stored_avatar_not_the_cached_one(api, db, monkeypatch):
+    monkeypatch.setattr(server, "get_image_executor", lambda: None)
+    run(db.users.insert_one({"id": "u1", "email": "u1@example.com", "name": "U1",
+                             "created_at": "2024-01-01T00:00:00+00:00"}))
+
+    def upload(color):
+        image = io.BytesIO()
+        Image.new("RGB", (300, 200), color).save(image, "JPEG")
+        response = api.post(
+            "/api/profile/avatar",
+            files={"avatar": ("a.jpg", image.getvalue(), "image/jpeg")},
+            data={"authorization": auth_header("u1")["Authorization"]},
+        )
+        assert response.status_code == 200
+        return response.json()["avatar"].removeprefix("/api/images/")
+
+    first = upload("red")
+    api.get("/api/auth/me", headers=auth_header("u1"))
+    # Another worker replaces the avatar; this worker's cached user still has the first one
+    run(server.storage.put("avatars/u1-other.jpg", b"x", "image/jpeg"))
+    run(db.users.update_one({"id": "u1"}, {"$set": {"avatar": "/api/images/avatars/u1-other.jpg"}}))
+    assert server.user_cache.get("u1")["avatar"] == f"/api/images/{first}"
+
+    second = upload("blue")
+    assert not run(server.storage.exists("avatars/u1-other.jpg"))
+    assert run(server.storage.exists(first))
+    assert run(server.storage.exists(second))
+
+
+def test_busy_image_slots_answer_503_without_leaking(db, monkeypatch):
+    monkeypatch.setattr(server, "IMAGE_QUEUE_TIMEOUT", 0.01)
+    monkeypatch.setattr(server, "image_slots", asyncio.Semaphore(1))
+    monkeypatch.setattr(server, "get_image_executor", lambda: None)
+
+    async def scenario():
+        await server.image_slots.acquire()
+        with pytest.raises(server.HTTPException) as exc:
+            await server.run_image_task(len, b"abc")
+        assert exc.value.status_code == 503
+        server.image_slots.release()
+
+        assert await server.run_image_task(len, b"abc") == 3
+        assert not server.image_slots.locked()
+    run(scenario())
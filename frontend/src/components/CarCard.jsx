@@ -46,7 +46,7 @@ export default function CarCard({ car, isFavorite = false, onFavoriteChange }) {
   };
 
   const imageUrl = car.images?.[0] 
-    ? `${BACKEND_URL}${car.images[0]}`
+    ? `${BACKEND_URL}${car.image_renditions?.[0]?.card || car.images[0]}`
     : "https://images.unsplash.com/photo-1552300878-295b1871e1b4?auto=format&fit=crop&w=800&q=80";
 
   const toggleFavorite = async (e) => {
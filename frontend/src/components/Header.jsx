@@ -27,14 +27,63 @@ export default function Header({ onOpenSearch }) {
   useEffect(() => {
     if (user && token) {
       fetchUnreadCount();
-      const interval = setInterval(fetchUnreadCount, 30000);
 
       // Listen for manual read events from MessagesPage
       const handleReadEvent = () => fetchUnreadCount();
       window.addEventListener("messages-read", handleReadEvent);
 
+      // The server pushes unread counts and message events; other components
+      // receive them as "message-event" window events. Browsers without
+      // EventSource fall back to polling.
+      let source = null;
+      let interval = null;
+      let reconnect = null;
+      let closed = false;
+      const forward = (e) => {
+        window.dispatchEvent(new CustomEvent("message-event", { detail: JSON.parse(e.data) }));
+      };
+      // EventSource can't send headers, so each connection uses a short-lived,
+      // single-use ticket; that also means reconnecting ourselves with a new one
+      const connect = async (isReconnect) => {
+        let ticket;
+        try {
+          const res = await axios.post(`${API}/events/ticket`, null, {
+            headers: { Authorization: `Bearer ${token}` }
+          });
+          ticket = res.data.ticket;
+        } catch (e) {
+          if (!closed) reconnect = setTimeout(() => connect(true), 30000);
+          return;
+        }
+        if (closed) return;
+        source = new EventSource(`${API}/events?ticket=${encodeURIComponent(ticket)}`);
+        source.addEventListener("unread-count", (e) => setUnreadCount(JSON.parse(e.data).count));
+        source.addEventListener("message", forward);
+        source.addEventListener("read", forward);
+        source.addEventListener("resync", (e) => {
+          fetchUnreadCount();
+          forward(e);
+        });
+        if (isReconnect) {
+          // Events sent while disconnected are lost
+          source.addEventListener("open", () => forward({ data: JSON.stringify({ type: "resync" }) }), { once: true });
+        }
+        source.onerror = () => {
+          source.close();
+          if (!closed) reconnect = setTimeout(() => connect(true), 3000);
+        };
+      };
+      if (window.EventSource) {
+        connect(false);
+      } else {
+        interval = setInterval(fetchUnreadCount, 30000);
+      }
+
       return () => {
-        clearInterval(interval);
+        closed = true;
+        if (source) source.close();
+        if (reconnect) clearTimeout(reconnect);
+        if (interval) clearInterval(interval);
         window.removeEventListener("messages-read", handleReadEvent);
       };
     }
@@ -128,6 +128,27 @@ export default function CarDetailPage() {
     }
   }, [car?.user_id, fetchSeller]);
 
+  // Freshly uploaded photos are processed in the background
+  useEffect(() => {
+    if (car?.image_status !== "processing") return;
+    const timer = setInterval(async () => {
+      try {
+        const res = await axios.get(`${API}/listings/${id}/image-status`);
+        if (res.data.status !== "processing") {
+          setCar(prev => ({
+            ...prev,
+            images: res.data.images,
+            image_renditions: res.data.image_renditions,
+            image_status: res.data.status
+          }));
+        }
+      } catch (err) {
+        console.error("Failed to fetch image status:", err);
+      }
+    }, 3000);
+    return () => clearInterval(timer);
+  }, [car?.image_status, id]);
+
   const formatPrice = (price) => {
     return new Intl.NumberFormat('en-US', {
       style: 'currency',
@@ -262,7 +283,7 @@ export default function CarDetailPage() {
                     }`}
                   >
                     <img
-                      src={`${BACKEND_URL}${img}`}
+                      src={`${BACKEND_URL}${car.image_renditions?.[idx]?.thumb || img}`}
                       alt={`Thumbnail ${idx + 1}`}
                       className="w-full h-full object-cover"
                     />
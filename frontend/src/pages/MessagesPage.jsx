@@ -12,12 +12,21 @@ export default function MessagesPage() {
   const { user, token } = useAuth();
   const navigate = useNavigate();
   const [threads, setThreads] = useState([]);
+  const [threadsCursor, setThreadsCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [activeConversation, setActiveConversation] = useState(null);
   const [conversationMessages, setConversationMessages] = useState([]);
   const [conversationLoading, setConversationLoading] = useState(false);
+  const [conversationCursor, setConversationCursor] = useState(null);
+  const [loadingEarlier, setLoadingEarlier] = useState(false);
   const [replyText, setReplyText] = useState("");
   const messagesEndRef = useRef(null);
+  const activeConversationRef = useRef(null);
+
+  useEffect(() => {
+    activeConversationRef.current = activeConversation;
+  }, [activeConversation]);
 
   useEffect(() => {
     if (!user) {
@@ -31,15 +40,39 @@ export default function MessagesPage() {
       // Fetch threads but don't show loading spinner to avoid flickering
       axios.get(`${API}/messages/threads`, {
         headers: { Authorization: `Bearer ${token}` }
-      }).then(res => setThreads(res.data)).catch(() => { });
+      }).then(res => {
+        setThreads(res.data);
+        setThreadsCursor(res.headers["x-next-cursor"] || null);
+      }).catch(() => { });
     };
     window.addEventListener("messages-read", handleReadEvent);
-    return () => window.removeEventListener("messages-read", handleReadEvent);
+
+    // Pushed by the Header's event stream: refresh the sidebar, and the open
+    // conversation when the other participant wrote to it
+    const handleMessageEvent = (e) => {
+      const event = e.detail;
+      if (event.type === "read") return;
+      handleReadEvent();
+      const active = activeConversationRef.current;
+      if (!active) return;
+      const msg = event.message;
+      if (event.type === "resync" ||
+        (msg.listing_id === active.listing_id && msg.sender_id === active.other_user_id)) {
+        refreshConversation(active);
+      }
+    };
+    window.addEventListener("message-event", handleMessageEvent);
+    return () => {
+      window.removeEventListener("messages-read", handleReadEvent);
+      window.removeEventListener("message-event", handleMessageEvent);
+    };
   }, [user, navigate, token]);
 
+  // Only follow new messages; loading earlier ones keeps the scroll position
+  const newestMessageId = conversationMessages[conversationMessages.length - 1]?.id;
   useEffect(() => {
     scrollToBottom();
-  }, [conversationMessages]);
+  }, [newestMessageId]);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -52,6 +85,7 @@ export default function MessagesPage() {
         headers: { Authorization: `Bearer ${token}` }
       });
       setThreads(res.data);
+      setThreadsCursor(res.headers["x-next-cursor"] || null);
     } catch (err) {
       toast.error("Failed to load messages");
     } finally {
@@ -59,6 +93,59 @@ export default function MessagesPage() {
     }
   };
 
+  const loadMoreThreads = async () => {
+    if (!threadsCursor) return;
+    setLoadingMore(true);
+    try {
+      const res = await axios.get(`${API}/messages/threads`, {
+        params: { cursor: threadsCursor },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setThreads(prev => [...prev, ...res.data]);
+      setThreadsCursor(res.headers["x-next-cursor"] || null);
+    } catch (err) {
+      toast.error("Failed to load messages");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // The API pages newest first; the chat shows oldest first
+  const fetchConversationPage = async (conversation, before) => {
+    const res = await axios.get(`${API}/messages/conversation`, {
+      params: { listing_id: conversation.listing_id, other_user_id: conversation.other_user_id, before },
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    return { messages: [...res.data].reverse(), cursor: res.headers["x-next-cursor"] || null };
+  };
+
+  // Merge the newest page into what is loaded, keeping earlier pages (unless
+  // the user switched conversations while it was loading)
+  const mergeNewest = (conversation, messages) => {
+    const active = activeConversationRef.current;
+    if (!active || active.listing_id !== conversation.listing_id ||
+      active.other_user_id !== conversation.other_user_id) return;
+    setConversationMessages(prev => {
+      const known = new Set(prev.map(m => m.id));
+      return [...prev, ...messages.filter(m => !known.has(m.id))]
+        .sort((a, b) => a.created_at.localeCompare(b.created_at));
+    });
+  };
+
+  const loadEarlierMessages = async () => {
+    if (!conversationCursor || !activeConversation) return;
+    setLoadingEarlier(true);
+    try {
+      const page = await fetchConversationPage(activeConversation, conversationCursor);
+      setConversationMessages(prev => [...page.messages, ...prev]);
+      setConversationCursor(page.cursor);
+    } catch (err) {
+      toast.error("Failed to load conversation");
+    } finally {
+      setLoadingEarlier(false);
+    }
+  };
+
   const openConversation = async (thread) => {
     setActiveConversation({
       listing_id: thread.listing_id,
@@ -70,11 +157,9 @@ export default function MessagesPage() {
 
     setConversationLoading(true);
     try {
-      const res = await axios.get(`${API}/messages/conversation`, {
-        params: { listing_id: thread.listing_id, other_user_id: thread.other_user_id },
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      setConversationMessages(res.data);
+      const page = await fetchConversationPage(thread);
+      setConversationMessages(page.messages);
+      setConversationCursor(page.cursor);
       setReplyText("");
 
       // Mark as read on server
@@ -98,6 +183,21 @@ export default function MessagesPage() {
     }
   };
 
+  const refreshConversation = async (conversation) => {
+    try {
+      const page = await fetchConversationPage(conversation);
+      mergeNewest(conversation, page.messages);
+      await axios.post(`${API}/messages/read-conversation`, {
+        listing_id: conversation.listing_id,
+        other_user_id: conversation.other_user_id
+      }, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+    } catch (e) {
+      console.error("Failed to refresh conversation", e);
+    }
+  };
+
   const handleBackToList = () => {
     setActiveConversation(null);
   };
@@ -114,11 +214,8 @@ export default function MessagesPage() {
         headers: { Authorization: `Bearer ${token}` },
       });
 
-      const res = await axios.get(`${API}/messages/conversation`, {
-        params: { listing_id: activeConversation.listing_id, other_user_id: activeConversation.other_user_id },
-        headers: { Authorization: `Bearer ${token}` },
-      });
-      setConversationMessages(res.data);
+      const page = await fetchConversationPage(activeConversation);
+      mergeNewest(activeConversation, page.messages);
       setReplyText("");
     } catch (err) {
       toast.error("Failed to send message");
@@ -193,6 +290,13 @@ export default function MessagesPage() {
               </div>
             ) : (
               <>
+                {conversationCursor && (
+                  <div className="flex justify-center">
+                    <Button variant="ghost" size="sm" onClick={loadEarlierMessages} disabled={loadingEarlier}>
+                      {loadingEarlier ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load earlier messages"}
+                    </Button>
+                  </div>
+                )}
                 {conversationMessages.map((m) => {
                   const isMe = m.sender_id === user.id;
                   return (
@@ -334,6 +438,17 @@ export default function MessagesPage() {
                     </button>
                   );
                 })}
+                {threadsCursor && (
+                  <button
+                    type="button"
+                    data-testid="load-more-threads"
+                    onClick={loadMoreThreads}
+                    disabled={loadingMore}
+                    className="w-full p-3 text-sm text-slate-500 hover:bg-slate-50 flex items-center justify-center"
+                  >
+                    {loadingMore ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load more"}
+                  </button>
+                )}
               </div>
             </div>
 
@@ -376,6 +491,13 @@ export default function MessagesPage() {
                       </div>
                     ) : (
                       <>
+                        {conversationCursor && (
+                          <div className="flex justify-center">
+                            <Button variant="ghost" size="sm" onClick={loadEarlierMessages} disabled={loadingEarlier}>
+                              {loadingEarlier ? <Loader2 className="w-4 h-4 animate-spin" /> : "Load earlier messages"}
+                            </Button>
+                          </div>
+                        )}
                         {conversationMessages.map((m) => {
                           const isMe = m.sender_id === user.id;
                           return (
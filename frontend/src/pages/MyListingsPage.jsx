@@ -146,7 +146,7 @@ export default function MyListingsPage() {
                 {/* Image */}
                 <div className="w-full sm:w-48 h-36 rounded-lg overflow-hidden bg-slate-100 flex-shrink-0">
                   <img
-                    src={car.images?.[0] ? `${BACKEND_URL}${car.images[0]}` : "https://images.unsplash.com/photo-1552300878-295b1871e1b4?auto=format&fit=crop&w=400&q=80"}
+                    src={car.images?.[0] ? `${BACKEND_URL}${car.image_renditions?.[0]?.card || car.images[0]}` : "https://images.unsplash.com/photo-1552300878-295b1871e1b4?auto=format&fit=crop&w=400&q=80"}
                     alt={`${car.make} ${car.model}`}
                     className="w-full h-full object-cover"
                   />